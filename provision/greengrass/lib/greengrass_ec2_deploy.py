@@ -56,6 +56,7 @@ class EC2GreengrassDeploy(core.Construct):
         user_data = user_data.replace("<thing_policy>", core_policy_name)
         user_data = user_data.replace("<group_role_arn>", group_role_arn)
         user_data = user_data.replace("<fleet>", fleet)
+        user_data = user_data.replace("<spool_volume>", os.environ.get('SPOOL_VOLUME', '/var/spool/greengrass'))
 
         # Create an autoscaling group to make it simpler in the workshop to add new Greengrass
         # groups. Start with 2 instances
@@ -0,0 +1,88 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import boto3
+import os
+import threading
+import time
+from botocore.config import Config
+
+# The client() of provision/project/code/lib/aws_clients.py with only the
+# rates of the calls clean_up.py and register_greengrass_client.py make.
+# TokenBucket and client() are kept identical to that file.
+
+# Requests per second allowed per API operation before a call waits for a
+# token. These are conservative starting points, they can be overridden per
+# call site or with AWS_API_RATES="GetGroup=20,DeleteGroup=5".
+DEFAULT_RATES = {
+    'greengrass': {
+        'GetGroup': 20,
+        'ListGroups': 5,
+        'ResetDeployments': 5,
+        'DeleteGroup': 5,
+    },
+    'iot': {
+        'ListThings': 5,
+        'ListThingPrincipals': 10,
+        'DetachThingPrincipal': 10,
+        'DeleteThing': 10,
+        'UpdateCertificate': 10,
+        'DeleteCertificate': 10,
+    },
+}
+
+
+class TokenBucket:
+    # Thread safe token bucket, acquire blocks until a token is available
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_rates(value):
+    rates = {}
+    for item in filter(None, value.split(',')):
+        operation, rate = item.split('=')
+        rates[operation.strip()] = float(rate)
+    return rates
+
+
+def client(service_name, max_concurrency=10, rates=None, **kwargs):
+    # A boto3 client with adaptive retries on throttling, a connection pool
+    # large enough for max_concurrency threads and a token bucket per API
+    # operation. The buckets hook into before-call so paginators are
+    # throttled as well.
+    config = Config(
+        retries={'max_attempts': 10, 'mode': 'adaptive'},
+        max_pool_connections=max(10, max_concurrency),
+    )
+    service_client = boto3.client(service_name, config=config, **kwargs)
+
+    operation_rates = dict(DEFAULT_RATES.get(service_name, {}))
+    operation_rates.update(rates or {})
+    operation_rates.update(parse_rates(os.environ.get('AWS_API_RATES', '')))
+    buckets = {operation: TokenBucket(rate) for operation, rate in operation_rates.items() if rate}
+
+    def throttle(model, **kwargs):
+        bucket = buckets.get(model.name)
+        if bucket:
+            bucket.acquire()
+
+    service_client.meta.events.register('before-call', throttle)
+    return service_client
+
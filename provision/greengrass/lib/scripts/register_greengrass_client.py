@@ -1,9 +1,9 @@
-import boto3
 import argparse
 import json
 import uuid
 from zipfile import ZipFile
 from botocore.exceptions import ClientError
+from aws_clients import client
 
 def CreateThingAndAttachedCert(iot, thing_name, certArn):
     iot.create_thing(
@@ -33,10 +33,10 @@ region = args.region
 account = args.account
 thing_arn = 'arn:aws:iot:{}:{}:thing/{}'.format(region, account, core_name)
 
-iot = boto3.client('iot', region_name=region)
-greengrass = boto3.client("greengrass", region_name=region)
-ssm = boto3.client('ssm', region_name=region)
-s3 = boto3.client('s3', region_name=region)
+iot = client('iot', region_name=region)
+greengrass = client("greengrass", region_name=region)
+ssm = client('ssm', region_name=region)
+s3 = client('s3', region_name=region)
 
 response = iot.create_keys_and_certificate(
     setAsActive=True
@@ -1,11 +1,7 @@
 #!/usr/bin/env python3
 import os
-import json
 from aws_cdk import core
 
-from lib.greengrass import LambdaFunction
-from lib.greengrass import LambdaAlias
-from lib.greengrass import GreengrassCoreGroupDefinitions
 GROUP_CONFIG_FILE = os.environ.get('GROUP_CONFIG_FILE','gg_group_config.json')
 env = core.Environment(
     account=os.environ['CDK_DEFAULT_ACCOUNT'],
@@ -14,33 +10,91 @@ env = core.Environment(
 
 app = core.App()
 
-lambda_stack = LambdaFunction(
-    app, 
-    id="iot-gg-cicd-workshop-function", 
-    env=env
-    )
-prod_alias_stack = LambdaAlias(
-    app, 
-    id="iot-gg-cicd-workshop-function-prod-alias", 
-    env=env,
+# Stacks to build, selected with -c stacks=canary or CDK_STACKS=function,prod-alias.
+# Every stack is built when none are selected, for cdk list and destroy.
+SELECTED_STACKS = [
+    name.strip() for name in (app.node.try_get_context('stacks') or os.environ.get('CDK_STACKS','')).split(',')
+    if name.strip()
+]
+# Groups per fleet are spread over this many stacks, by default one stack
+# per CORE_GROUP_SHARD_SIZE groups
+CORE_GROUP_SHARDS = int(os.environ.get('CORE_GROUP_SHARDS','0'))
+CORE_GROUP_SHARD_SIZE = int(os.environ.get('CORE_GROUP_SHARD_SIZE','64'))
+# One function and subscription definition per stack instead of per group
+SHARED_DEFINITIONS = os.environ.get('SHARED_DEFINITIONS','false').lower() == 'true'
+# Run the telemetry aggregation function next to the device shadow function
+TELEMETRY_AGGREGATION = os.environ.get('TELEMETRY_AGGREGATION','false').lower() == 'true'
+
+
+def deployment_parameter_sets():
+    # Every stack streams its own pass over the manifest. The stacks are
+    # only deployed to the synth region, a group of another region would be
+    # left out of them and deleted from its stack, so it fails the synth.
+    from lib.manifest import read_manifest
+    if not os.path.exists(GROUP_CONFIG_FILE):
+        return
+    if not env.region:
+        raise ValueError('CDK_DEFAULT_REGION is not set, the core group definition stacks need the region of the groups')
+    for deployment_parameter_set in read_manifest(GROUP_CONFIG_FILE):
+        region = deployment_parameter_set.get('Region', env.region)
+        if region != env.region:
+            raise ValueError('Group {} is in {} but the stacks are synthesized for {}. Set CDK_DEFAULT_REGION to the '
+                'region of the fleet. Multi-region fleets are deployed with the -direct targets once the function and '
+                'prod-alias stacks are deployed to every region'.format(
+                deployment_parameter_set['GroupId'], region, env.region))
+        yield deployment_parameter_set
+
+
+def lambda_stack():
+    from lib.greengrass import LambdaFunction
+    return LambdaFunction(
+        app, 
+        id="iot-gg-cicd-workshop-function", 
+        telemetry=TELEMETRY_AGGREGATION,
+        env=env
+        )
+
+
+def prod_alias_stack():
+    from lib.greengrass import LambdaAlias
+    return LambdaAlias(
+        app, 
+        id="iot-gg-cicd-workshop-function-prod-alias", 
+        telemetry=TELEMETRY_AGGREGATION,
+        env=env,
+        )
+
+
+def core_group_definition_versions_stacks(fleet):
+    from lib.greengrass import core_group_definition_stacks
+    from lib.greengrass import shard_count
+    from lib.function_settings import function_variables, telemetry_variables, spool_volume
+    shards = CORE_GROUP_SHARDS or shard_count(sum(1 for _ in deployment_parameter_sets()), CORE_GROUP_SHARD_SIZE)
+    return core_group_definition_stacks(
+        app,
+        id="iot-gg-cicd-workshop-core-group-definition-versions-{}".format(fleet),
+        deployment_parameter_sets=deployment_parameter_sets(),
+        shards=shards,
+        shared_definitions=SHARED_DEFINITIONS,
+        function_variables=function_variables(),
+        telemetry=TELEMETRY_AGGREGATION,
+        telemetry_variables=telemetry_variables(),
+        spool_volume=spool_volume(),
+        env=env,
     )
-try:
-    with open(GROUP_CONFIG_FILE, "r+") as json_file:
-        deployment_parameter_sets = json.load(json_file)
-except FileNotFoundError:
-    deployment_parameter_sets = []
-
-
-prod_core_group_definition_versions_stack = GreengrassCoreGroupDefinitions(
-    app,
-    id="iot-gg-cicd-workshop-core-group-definition-versions-canary",
-    deployment_parameter_sets=deployment_parameter_sets,
-    env=env,
-)
-prod_core_group_definition_versions_stack = GreengrassCoreGroupDefinitions(
-    app,
-    id="iot-gg-cicd-workshop-core-group-definition-versions-main",
-    deployment_parameter_sets=deployment_parameter_sets,
-    env=env,
-)
+
+
+STACKS = {
+    'function': lambda_stack,
+    'prod-alias': prod_alias_stack,
+    'canary': lambda: core_group_definition_versions_stacks('canary'),
+    'main': lambda: core_group_definition_versions_stacks('main'),
+}
+unknown = set(SELECTED_STACKS) - set(STACKS)
+if unknown:
+    raise ValueError('Unknown stacks {}, choose from {}'.format(', '.join(sorted(unknown)), ', '.join(STACKS)))
+
+for name, build in STACKS.items():
+    if not SELECTED_STACKS or name in SELECTED_STACKS:
+        build()
 app.synth()
@@ -0,0 +1,72 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Local benchmark of the deployment creation in lib/deploy.py against a
+# stubbed Greengrass client, no AWS account is needed.
+#
+#   venv/bin/python3 benchmark/deploy_benchmark.py --groups 500 --latency 0.05
+
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+import deploy
+
+
+class StubGreengrassClient:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _call(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def get_group(self, GroupId):
+        self._call()
+        return {'Id': GroupId, 'LatestVersion': 'version-{}'.format(GroupId)}
+
+    def get_group_version(self, GroupId, GroupVersionId):
+        self._call()
+        return {'Id': GroupId, 'Version': GroupVersionId}
+
+    def create_deployment(self, DeploymentType, GroupId, GroupVersionId):
+        self._call()
+        return {'DeploymentId': str(uuid.uuid4())}
+
+
+def run(deployment_parameter_sets, latency, workers):
+    gg_client = StubGreengrassClient(latency)
+    start = time.perf_counter()
+    deployments = deploy.create_deployments(gg_client, deployment_parameter_sets, workers=workers)
+    elapsed = time.perf_counter() - start
+    assert list(deployments) == [p['GroupId'] for p in deployment_parameter_sets]
+    return elapsed, gg_client.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent Greengrass deployment creation")
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per stubbed API call")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    deployment_parameter_sets = [{'GroupId': str(uuid.uuid4())} for i in range(args.groups)]
+
+    baseline = None
+    print('{:>8} {:>10} {:>8} {:>8}'.format('workers', 'seconds', 'calls', 'speedup'))
+    for workers in args.workers:
+        elapsed, calls = run(deployment_parameter_sets, args.latency, workers)
+        baseline = baseline or elapsed
+        print('{:>8} {:>10.2f} {:>8} {:>7.1f}x'.format(workers, elapsed, calls, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
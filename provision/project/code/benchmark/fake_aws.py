@@ -0,0 +1,359 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# In memory stand-in for the Greengrass, IoT and Resource Groups Tagging
+# APIs used by the deploy scripts. Every call is counted, delayed by a
+# configurable latency and checked against a per operation TPS limit.
+# Calls over the limit are counted as throttled and retried after a backoff,
+# the way the adaptive retry mode of the real clients behaves.
+
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+
+class FakeAws:
+    def __init__(self, latency=0.0, page_size=100, tps=None, deploy_seconds=1.0, failure_rate=0.0, region='us-east-1', account='123456789012'):
+        self.latency = latency
+        self.page_size = page_size
+        self.tps = tps or {}
+        self.deploy_seconds = deploy_seconds
+        self.failure_rate = failure_rate
+        self.region = region
+        self.account = account
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.groups = {}
+        self.core_definitions = {}
+        self.definitions = {}
+        self.things = {}
+        self.certificates = {}
+        self.deployments = {}
+
+    def add_fleet(self, size, fleet):
+        for i in range(size):
+            gg_id = uuid.uuid4().hex[:8]
+            group_id = str(uuid.uuid4())
+            core_definition_id = str(uuid.uuid4())
+            certificate_id = uuid.uuid4().hex
+            certificate_arn = 'arn:aws:iot:{}:{}:cert/{}'.format(self.region, self.account, certificate_id)
+            core_name = 'gg-core-{}'.format(gg_id)
+            thing_arn = 'arn:aws:iot:{}:{}:thing/{}'.format(self.region, self.account, core_name)
+
+            core_definition_version = str(uuid.uuid4())
+            self.core_definitions[core_definition_id] = {
+                'Id': core_definition_id,
+                'tags': {'fleet': fleet},
+                'Versions': {core_definition_version: {'Cores': [{'Id': '1', 'ThingArn': thing_arn, 'CertificateArn': certificate_arn, 'SyncShadow': True}]}},
+            }
+            group_version = str(uuid.uuid4())
+            self.groups[group_id] = {
+                'Id': group_id,
+                'Name': 'gg-group-{}'.format(gg_id),
+                'Arn': 'arn:aws:greengrass:{}:{}:/greengrass/groups/{}'.format(self.region, self.account, group_id),
+                'LatestVersion': group_version,
+                'tags': {'fleet': fleet},
+                'Versions': {group_version: {
+                    'CoreDefinitionVersionArn': 'arn:aws:greengrass:{}:{}:/greengrass/definition/cores/{}/versions/{}'.format(
+                        self.region, self.account, core_definition_id, core_definition_version),
+                }},
+            }
+            self.certificates[certificate_id] = {'Status': 'ACTIVE'}
+            for thing_name in (core_name, 'gg-device-{}'.format(gg_id)):
+                self.things[thing_name] = {'principals': [certificate_arn]}
+        return self
+
+    def client(self, service_name):
+        return {
+            'greengrass': FakeGreengrass,
+            'iot': FakeIot,
+            'resourcegroupstaggingapi': FakeTagging,
+        }[service_name](self)
+
+    def call(self, operation):
+        # Count the call, apply the per operation TPS limit and the latency
+        attempt = 0
+        while True:
+            with self.lock:
+                self.calls[operation] += 1
+                limit = self.tps.get(operation)
+                allowed = True
+                if limit:
+                    second = int(time.monotonic())
+                    window = self.windows.get(operation)
+                    if window is None or window[0] != second:
+                        window = [second, 0]
+                        self.windows[operation] = window
+                    window[1] += 1
+                    allowed = window[1] <= limit
+                if not allowed:
+                    self.throttled[operation] += 1
+            if self.latency:
+                time.sleep(self.latency)
+            if allowed:
+                return
+            time.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+            attempt += 1
+
+    def page(self, items, token, page_size=None):
+        start = int(token or 0)
+        end = start + (page_size or self.page_size)
+        return items[start:end], (str(end) if end < len(items) else None)
+
+
+class FakePaginator:
+    # Mimics boto3 paginators, including PaginationConfig MaxItems
+    def __init__(self, method, input_token, output_token, result_key):
+        self.method = method
+        self.input_token = input_token
+        self.output_token = output_token
+        self.result_key = result_key
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        max_items = (PaginationConfig or {}).get('MaxItems')
+        returned = 0
+        token = None
+        while True:
+            if token:
+                kwargs[self.input_token] = token
+            page = self.method(**kwargs)
+            if max_items is not None:
+                page[self.result_key] = page[self.result_key][:max_items - returned]
+            returned += len(page[self.result_key])
+            yield page
+            token = page.get(self.output_token)
+            if not token or (max_items is not None and returned >= max_items):
+                return
+
+
+class FakeClient:
+    paginators = {}
+
+    def __init__(self, aws):
+        self.aws = aws
+
+    def get_paginator(self, operation_name):
+        input_token, output_token, result_key = self.paginators[operation_name]
+        return FakePaginator(getattr(self, operation_name), input_token, output_token, result_key)
+
+
+class FakeTagging(FakeClient):
+    paginators = {'get_resources': ('PaginationToken', 'PaginationToken', 'ResourceTagMappingList')}
+
+    def get_resources(self, TagFilters=(), ResourceTypeFilters=(), PaginationToken=None):
+        self.aws.call('GetResources')
+        groups = [
+            group for group in self.aws.groups.values()
+            if all(group['tags'].get(tag_filter['Key']) in tag_filter['Values'] for tag_filter in TagFilters)
+        ]
+        items, token = self.aws.page(groups, PaginationToken)
+        return {
+            'ResourceTagMappingList': [
+                {'ResourceARN': group['Arn'], 'Tags': [{'Key': k, 'Value': v} for k, v in group['tags'].items()]}
+                for group in items
+            ],
+            'PaginationToken': token or '',
+        }
+
+
+class FakeGreengrass(FakeClient):
+    paginators = {
+        'list_groups': ('NextToken', 'NextToken', 'Groups'),
+        'list_core_definitions': ('NextToken', 'NextToken', 'Definitions'),
+        'list_function_definitions': ('NextToken', 'NextToken', 'Definitions'),
+        'list_subscription_definitions': ('NextToken', 'NextToken', 'Definitions'),
+        'list_resource_definitions': ('NextToken', 'NextToken', 'Definitions'),
+    }
+
+    def _group(self, group):
+        return {
+            'Id': group['Id'],
+            'Name': group['Name'],
+            'Arn': group['Arn'],
+            'LatestVersion': group['LatestVersion'],
+            'LatestVersionArn': '{}/versions/{}'.format(group['Arn'], group['LatestVersion']),
+        }
+
+    def list_groups(self, MaxResults=None, NextToken=None):
+        self.aws.call('ListGroups')
+        items, token = self.aws.page(list(self.aws.groups.values()), NextToken, MaxResults and int(MaxResults))
+        response = {'Groups': [self._group(group) for group in items]}
+        if token:
+            response['NextToken'] = token
+        return response
+
+    def get_group(self, GroupId):
+        self.aws.call('GetGroup')
+        group = self.aws.groups[GroupId]
+        return dict(self._group(group), tags=dict(group['tags']))
+
+    def get_group_version(self, GroupId, GroupVersionId):
+        self.aws.call('GetGroupVersion')
+        group = self.aws.groups[GroupId]
+        return {'Id': GroupId, 'Version': GroupVersionId, 'Definition': dict(group['Versions'][GroupVersionId])}
+
+    def get_core_definition_version(self, CoreDefinitionId, CoreDefinitionVersionId):
+        self.aws.call('GetCoreDefinitionVersion')
+        core_definition = self.aws.core_definitions[CoreDefinitionId]
+        return {'Id': CoreDefinitionId, 'Version': CoreDefinitionVersionId, 'Definition': core_definition['Versions'][CoreDefinitionVersionId]}
+
+    def list_core_definitions(self, NextToken=None):
+        self.aws.call('ListCoreDefinitions')
+        items, token = self.aws.page(list(self.aws.core_definitions.values()), NextToken)
+        response = {'Definitions': [{'Id': core_definition['Id']} for core_definition in items]}
+        if token:
+            response['NextToken'] = token
+        return response
+
+    def get_core_definition(self, CoreDefinitionId):
+        self.aws.call('GetCoreDefinition')
+        core_definition = self.aws.core_definitions[CoreDefinitionId]
+        return {'Id': CoreDefinitionId, 'tags': dict(core_definition['tags'])}
+
+    def delete_core_definition(self, CoreDefinitionId):
+        self.aws.call('DeleteCoreDefinition')
+        del self.aws.core_definitions[CoreDefinitionId]
+
+    def create_deployment(self, DeploymentType, GroupId, GroupVersionId):
+        self.aws.call('CreateDeployment')
+        deployment_id = str(uuid.uuid4())
+        failed = random.random() < self.aws.failure_rate
+        with self.aws.lock:
+            self.aws.deployments[deployment_id] = (time.monotonic() + self.aws.deploy_seconds, failed)
+        return {'DeploymentId': deployment_id, 'DeploymentArn': '{}/deployments/{}'.format(self.aws.groups[GroupId]['Arn'], deployment_id)}
+
+    def get_deployment_status(self, GroupId, DeploymentId):
+        self.aws.call('GetDeploymentStatus')
+        done_at, failed = self.aws.deployments[DeploymentId]
+        if time.monotonic() < done_at:
+            return {'DeploymentStatus': 'InProgress', 'DeploymentType': 'NewDeployment'}
+        if failed:
+            return {'DeploymentStatus': 'Failure', 'DeploymentType': 'NewDeployment', 'ErrorMessage': 'Simulated failure', 'ErrorDetails': []}
+        return {'DeploymentStatus': 'Success', 'DeploymentType': 'NewDeployment'}
+
+    def reset_deployments(self, GroupId, Force=False):
+        self.aws.call('ResetDeployments')
+        return {}
+
+    def _create_definition(self, kind, Name, InitialVersion):
+        self.aws.call('Create{}Definition'.format(kind.capitalize()))
+        definition_id = str(uuid.uuid4())
+        with self.aws.lock:
+            self.aws.definitions[definition_id] = {'Id': definition_id, 'Name': Name, 'Kind': kind, 'Versions': {}}
+            if kind == 'core':
+                self.aws.core_definitions[definition_id] = dict(self.aws.definitions[definition_id], tags={})
+        return {'Id': definition_id, 'LatestVersionArn': self._add_version(kind, definition_id, InitialVersion)}
+
+    def _create_definition_version(self, kind, definition_id, content):
+        self.aws.call('Create{}DefinitionVersion'.format(kind.capitalize()))
+        return {'Id': definition_id, 'Arn': self._add_version(kind, definition_id, content)}
+
+    def _add_version(self, kind, definition_id, content):
+        # Core definitions created by add_fleet are only in core_definitions
+        version = str(uuid.uuid4())
+        with self.aws.lock:
+            definition = self.aws.core_definitions[definition_id] if kind == 'core' else self.aws.definitions[definition_id]
+            definition['Versions'][version] = content
+        return 'arn:aws:greengrass:{}:{}:/greengrass/definition/{}s/{}/versions/{}'.format(
+            self.aws.region, self.aws.account, kind, definition_id, version)
+
+    def _list_definitions(self, kind, NextToken=None):
+        self.aws.call('List{}Definitions'.format(kind.capitalize()))
+        definitions = [definition for definition in list(self.aws.definitions.values()) if definition['Kind'] == kind]
+        items, token = self.aws.page(definitions, NextToken)
+        response = {'Definitions': [{'Id': definition['Id'], 'Name': definition['Name']} for definition in items]}
+        if token:
+            response['NextToken'] = token
+        return response
+
+    def create_core_definition(self, AmznClientToken=None, **kwargs):
+        return self._create_definition('core', **kwargs)
+
+    def create_device_definition(self, AmznClientToken=None, **kwargs):
+        return self._create_definition('device', **kwargs)
+
+    def create_function_definition(self, AmznClientToken=None, **kwargs):
+        return self._create_definition('function', **kwargs)
+
+    def create_subscription_definition(self, AmznClientToken=None, **kwargs):
+        return self._create_definition('subscription', **kwargs)
+
+    def create_resource_definition(self, AmznClientToken=None, **kwargs):
+        return self._create_definition('resource', **kwargs)
+
+    def create_core_definition_version(self, CoreDefinitionId, AmznClientToken=None, **kwargs):
+        return self._create_definition_version('core', CoreDefinitionId, kwargs)
+
+    def create_device_definition_version(self, DeviceDefinitionId, AmznClientToken=None, **kwargs):
+        return self._create_definition_version('device', DeviceDefinitionId, kwargs)
+
+    def create_function_definition_version(self, FunctionDefinitionId, AmznClientToken=None, **kwargs):
+        return self._create_definition_version('function', FunctionDefinitionId, kwargs)
+
+    def create_subscription_definition_version(self, SubscriptionDefinitionId, AmznClientToken=None, **kwargs):
+        return self._create_definition_version('subscription', SubscriptionDefinitionId, kwargs)
+
+    def create_resource_definition_version(self, ResourceDefinitionId, AmznClientToken=None, **kwargs):
+        return self._create_definition_version('resource', ResourceDefinitionId, kwargs)
+
+    def list_function_definitions(self, NextToken=None):
+        return self._list_definitions('function', NextToken)
+
+    def list_subscription_definitions(self, NextToken=None):
+        return self._list_definitions('subscription', NextToken)
+
+    def list_resource_definitions(self, NextToken=None):
+        return self._list_definitions('resource', NextToken)
+
+    def create_group_version(self, GroupId, AmznClientToken=None, **definition):
+        self.aws.call('CreateGroupVersion')
+        group = self.aws.groups[GroupId]
+        version = str(uuid.uuid4())
+        with self.aws.lock:
+            group['Versions'][version] = dict(definition)
+            group['LatestVersion'] = version
+        return {'Id': GroupId, 'Version': version, 'Arn': '{}/versions/{}'.format(group['Arn'], version)}
+
+    def tag_resource(self, ResourceArn, tags):
+        self.aws.call('TagResource')
+        self.aws.groups[ResourceArn.split('/')[-1]]['tags'].update(tags)
+
+    def delete_group(self, GroupId):
+        self.aws.call('DeleteGroup')
+        del self.aws.groups[GroupId]
+
+
+class FakeIot(FakeClient):
+    paginators = {'list_things': ('nextToken', 'nextToken', 'things')}
+
+    def list_things(self, nextToken=None, maxResults=None):
+        self.aws.call('ListThings')
+        items, token = self.aws.page(sorted(self.aws.things), nextToken, maxResults)
+        response = {'things': [{'thingName': thing_name} for thing_name in items]}
+        if token:
+            response['nextToken'] = token
+        return response
+
+    def list_thing_principals(self, thingName):
+        self.aws.call('ListThingPrincipals')
+        return {'principals': list(self.aws.things[thingName]['principals'])}
+
+    def detach_thing_principal(self, thingName, principal):
+        self.aws.call('DetachThingPrincipal')
+        self.aws.things[thingName]['principals'].remove(principal)
+
+    def delete_thing(self, thingName):
+        self.aws.call('DeleteThing')
+        del self.aws.things[thingName]
+
+    def update_certificate(self, certificateId, newStatus):
+        self.aws.call('UpdateCertificate')
+        self.aws.certificates[certificateId]['Status'] = newStatus
+
+    def delete_certificate(self, certificateId, forceDelete=False):
+        self.aws.call('DeleteCertificate')
+        del self.aws.certificates[certificateId]
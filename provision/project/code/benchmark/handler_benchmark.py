@@ -0,0 +1,213 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Offline microbenchmark of the device shadow function handler in
+# src/lambda/device_shadow.py with a fake greengrasssdk, no core is needed.
+#
+#   venv/bin/python3 benchmark/handler_benchmark.py --rate 2000 --threads 1 8 --latency 0.005
+#
+# Every scenario runs in its own process with its function settings in the
+# environment, the handler is driven at the target message rate from one or
+# more threads. Reports throughput, handler latency percentiles, the shadow
+# writes that reached the fake SDK and the memory tracemalloc sees allocated
+# per message in a second, untimed pass.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LAMBDA_DIR = os.path.join(CODE_DIR, 'src', 'lambda')
+DEVICE_NAME = 'gg-device-benchmark'
+
+# Function settings of each scenario, see the README
+SCENARIOS = {
+    'direct': {},
+    'coalesce': {'COALESCE_UPDATES': 'true'},
+    'suppress': {'SUPPRESS_UNCHANGED': 'true'},
+    'spool': {'SPOOL_WRITES': 'true'},
+}
+
+
+class FakeIotData:
+    # Stand-in for the greengrasssdk iot-data client, every call sleeps for
+    # latency seconds and fails with failure_rate
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self.shadows = {}
+        self.lock = threading.Lock()
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            fail = self.failure_rate and self.calls * self.failure_rate % 1 < self.failure_rate
+            if fail:
+                self.failures += 1
+        if fail:
+            raise Exception('Simulated failure')
+
+    def update_thing_shadow(self, thingName, payload):
+        self._call()
+        reported = json.loads(payload)['state']['reported']
+        with self.lock:
+            self.shadows.setdefault(thingName, {}).update(reported)
+
+    def get_thing_shadow(self, thingName):
+        self._call()
+        with self.lock:
+            if thingName not in self.shadows:
+                raise Exception('ResourceNotFoundException')
+            return {'payload': json.dumps({'state': {'reported': self.shadows[thingName]}}).encode()}
+
+    def publish(self, topic, payload):
+        self._call()
+
+
+def install_fake_sdk(latency, failure_rate):
+    fake = FakeIotData(latency, failure_rate)
+    module = types.ModuleType('greengrasssdk')
+    module.client = lambda name: fake
+    sys.modules['greengrasssdk'] = module
+    return fake
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0
+
+
+def drive(handler, messages, rate, threads, repeat):
+    # Spreads messages over threads, each paced at its share of rate.
+    # Returns the handler latency of every message, the number of handler
+    # errors and the elapsed time.
+    context = types.SimpleNamespace(client_context=types.SimpleNamespace(custom={'subject': '{}/update'.format(DEVICE_NAME)}))
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+    interval = threads / rate if rate else 0
+
+    def worker(index):
+        own = latencies[index]
+        start = time.perf_counter()
+        for n, i in enumerate(range(index, messages, threads)):
+            if interval:
+                delay = start + n * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            sent = time.perf_counter()
+            try:
+                handler({'message': i // repeat}, context)
+            except Exception:
+                errors[index] += 1
+            own.append(time.perf_counter() - sent)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return sorted(latency for own in latencies for latency in own), sum(errors), elapsed
+
+
+def run(scenario, args, threads):
+    os.environ['DEVICE_NAME'] = DEVICE_NAME
+    os.environ.update(SCENARIOS[scenario])
+    if scenario == 'spool':
+        os.environ.setdefault('SPOOL_DIR', tempfile.mkdtemp(prefix='handler-benchmark-'))
+    fake = install_fake_sdk(args.latency, args.failure_rate)
+    sys.path.insert(0, LAMBDA_DIR)
+    import device_shadow
+
+    latencies, errors, elapsed = drive(device_shadow.handler, args.messages, args.rate, threads, args.repeat)
+
+    # Allocations are traced in a separate pass, tracing slows every call
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    drive(device_shadow.handler, args.alloc_messages, 0, 1, args.repeat)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = after.compare_to(before, 'filename')
+
+    # Buffered and spooled writes reach the fake SDK before it is counted
+    if device_shadow.coalescer:
+        device_shadow.coalescer.stop()
+    if device_shadow.spool:
+        device_shadow.spool.drain()
+        device_shadow.spool.stop()
+
+    return {
+        'Scenario': scenario,
+        'Threads': threads,
+        'Messages': args.messages,
+        'TargetRate': args.rate,
+        'Latency': args.latency,
+        'Seconds': elapsed,
+        'MessagesPerSecond': args.messages / elapsed,
+        'P50Ms': percentile(latencies, 50) * 1000,
+        'P90Ms': percentile(latencies, 90) * 1000,
+        'P99Ms': percentile(latencies, 99) * 1000,
+        'MaxMs': latencies[-1] * 1000 if latencies else 0,
+        'HandlerErrors': errors,
+        'SdkCalls': fake.calls,
+        'SdkFailures': fake.failures,
+        'AllocatedBlocksPerMessage': sum(stat.count_diff for stat in retained) / max(1, args.alloc_messages),
+        'AllocatedBytesPerMessage': sum(stat.size_diff for stat in retained) / max(1, args.alloc_messages),
+        'PeakTracedKBPerMessage': peak / 1024 / max(1, args.alloc_messages),
+    }
+
+
+def run_isolated(scenario, args, threads):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--scenarios', scenario, '--threads', str(threads),
+        '--messages', str(args.messages), '--rate', str(args.rate), '--latency', str(args.latency),
+        '--failure-rate', str(args.failure_rate), '--repeat', str(args.repeat), '--alloc-messages', str(args.alloc_messages)]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the device shadow function handler with a fake greengrasssdk")
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8], help="threads calling the handler concurrently")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=0, help="target messages per second over all threads, 0 for as fast as possible")
+    parser.add_argument('--latency', type=float, default=0.002, help="seconds per greengrasssdk call")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of greengrasssdk calls that fail")
+    parser.add_argument('--repeat', type=int, default=10, help="consecutive messages with the same value, repeats are unchanged states")
+    parser.add_argument('--alloc-messages', type=int, default=1000, help="messages in the traced allocation pass")
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run(args.scenarios[0], args, args.threads[0])))
+        return
+
+    results = []
+    print('{:<10} {:>7} {:>10} {:>9} {:>9} {:>9} {:>9} {:>9} {:>11} {:>11} {:>7}'.format(
+        'scenario', 'threads', 'msg/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'sdk calls', 'blocks/msg', 'bytes/msg', 'errors'))
+    for scenario in args.scenarios:
+        for threads in args.threads:
+            result = run_isolated(scenario, args, threads)
+            results.append(result)
+            print('{Scenario:<10} {Threads:>7} {MessagesPerSecond:>10.0f} {P50Ms:>9.3f} {P90Ms:>9.3f} {P99Ms:>9.3f} {MaxMs:>9.3f} {SdkCalls:>9} {AllocatedBlocksPerMessage:>11.2f} {AllocatedBytesPerMessage:>11.1f} {HandlerErrors:>7}'.format(**result))
+
+    if args.output:
+        with open(args.output, "w+") as json_file:
+            json_file.write(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
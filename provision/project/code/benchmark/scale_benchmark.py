@@ -0,0 +1,153 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Offline scale benchmark of deployment_targets.py, greengrass_direct.py,
+# deploy.py and clean_up.py against the in memory stand-in in fake_aws.py, no
+# AWS account is needed.
+#
+#   venv/bin/python3 benchmark/scale_benchmark.py --groups 1000 10000 50000 --latency 0.002
+#
+# Reports wall clock time, API calls, throttled calls and peak Python memory
+# per scenario. The deploy settings are read from the usual DEPLOY_*
+# environment variables.
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'lib'))
+
+import deploy
+import deployment_targets
+import greengrass_direct
+from fake_aws import FakeAws
+from function_arns import FunctionArns
+
+# clean_up.py belongs to the Greengrass provisioning project, it is only
+# benchmarked when this runs from the workshop source tree
+GREENGRASS_LIB = os.path.join(BENCHMARK_DIR, '..', '..', '..', 'greengrass', 'lib')
+
+
+def load_clean_up():
+    path = os.path.join(GREENGRASS_LIB, 'clean_up.py')
+    if not os.path.exists(path):
+        return None
+    sys.path.insert(0, GREENGRASS_LIB)
+    spec = importlib.util.spec_from_file_location('clean_up', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(name, groups, aws, scenario):
+    aws.calls.clear()
+    aws.throttled.clear()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = scenario()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'Scenario': name,
+        'Groups': groups,
+        'Seconds': elapsed,
+        'Calls': sum(aws.calls.values()),
+        'Throttled': sum(aws.throttled.values()),
+        'PeakMemoryMB': peak / 1024 / 1024,
+        'CallsByOperation': dict(aws.calls),
+        'Result': result,
+    }
+
+
+def run(groups, args, clean_up):
+    aws = FakeAws(
+        latency=args.latency,
+        page_size=args.page_size,
+        tps=parse_tps(args.tps),
+        deploy_seconds=args.deploy_seconds,
+        failure_rate=args.failure_rate,
+    ).add_fleet(groups, 'main')
+    gg_client = aws.client('greengrass')
+    results = []
+
+    deployment_parameter_sets = []
+
+    def discover():
+        deployment_parameter_sets.extend(deployment_targets.discover(aws.client('resourcegroupstaggingapi'), gg_client, 'main'))
+        return '{} targets'.format(len(deployment_parameter_sets))
+    results.append(measure('deployment_targets', groups, aws, discover))
+
+    def create_group_versions():
+        function_arn = 'arn:aws:lambda:{}:{}:function:iot-gg-cicd-workshop-function:CANARY'.format(aws.region, aws.account)
+        regional = RegionalFake(aws, 'greengrass')
+        deployment_parameter_sets[:] = greengrass_direct.create_group_versions(regional, deployment_parameter_sets, FunctionArns([function_arn]))
+        return '{} group versions'.format(len(deployment_parameter_sets))
+    results.append(measure('greengrass_direct', groups, aws, create_group_versions))
+
+    def rollout():
+        failed = deploy.rollout(gg_client, deployment_parameter_sets)
+        return '{} failures'.format(len(failed))
+    results.append(measure('deploy', groups, aws, rollout))
+
+    if clean_up:
+        def delete():
+            clean_up.clean_up(aws.client('iot'), gg_client)
+            # Anything left behind is a bug, not a result
+            if aws.groups or aws.things or aws.core_definitions:
+                raise RuntimeError('clean_up left {} groups, {} things and {} core definitions of {} groups'.format(
+                    len(aws.groups), len(aws.things), len(aws.core_definitions), groups))
+            return 'nothing left'
+        results.append(measure('clean_up', groups, aws, delete))
+    return results
+
+
+class RegionalFake:
+    # Single region stand-in for aws_clients.RegionalClients
+    def __init__(self, aws, service_name):
+        self.service_client = aws.client(service_name)
+
+    def get(self, region=None):
+        return self.service_client
+
+
+def parse_tps(values):
+    return dict((operation, int(limit)) for operation, limit in (value.split('=') for value in values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the deploy scripts against a local AWS stand-in")
+    parser.add_argument('--groups', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--latency', type=float, default=0.002, help="seconds per API call")
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--tps', nargs='*', default=[], help="per operation limits, for example GetGroup=20")
+    parser.add_argument('--deploy-seconds', type=float, default=1.0, help="time a simulated deployment takes")
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    clean_up = load_clean_up()
+    if clean_up is None:
+        print('clean_up.py not found, skipping the clean_up scenario')
+
+    results = []
+    print('{:<20} {:>8} {:>10} {:>10} {:>10} {:>10}  {}'.format('scenario', 'groups', 'seconds', 'calls', 'throttled', 'peak MB', 'result'))
+    for groups in args.groups:
+        for result in run(groups, args, clean_up):
+            results.append(result)
+            print('{Scenario:<20} {Groups:>8} {Seconds:>10.2f} {Calls:>10} {Throttled:>10} {PeakMemoryMB:>10.1f}  {Result}'.format(**result))
+
+    if args.output:
+        with open(args.output, "w+") as json_file:
+            json_file.write(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
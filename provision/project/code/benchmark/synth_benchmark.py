@@ -0,0 +1,172 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Offline synth benchmark of the core group definition stacks in
+# lib/greengrass.py with generated fleets, no AWS account is needed.
+#
+#   venv/bin/python3 benchmark/synth_benchmark.py --groups 10 100 1000 10000 --profile out/synth.prof
+#
+# Every fleet size is synthesized in its own process. Reports the synth wall
+# time, peak memory of the Python process and of the jsii node process,
+# template bytes, resources and stacks. The profile of the largest fleet is
+# written with cProfile and its hottest functions are printed.
+
+import argparse
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def generate_fleet(groups, region='us-east-1', account='123456789012'):
+    for i in range(groups):
+        gg_id = uuid.uuid4().hex[:8]
+        yield {
+            'GroupId': str(uuid.uuid4()),
+            'GroupName': 'gg-group-{}'.format(gg_id),
+            'GroupVersionId': str(uuid.uuid4()),
+            'ThingArn': 'arn:aws:iot:{}:{}:thing/gg-core-{}'.format(region, account, gg_id),
+            'CertificateArn': 'arn:aws:iot:{}:{}:cert/{}'.format(region, account, uuid.uuid4().hex),
+            'Region': region,
+        }
+
+
+def child_peak_rss_mb():
+    # The constructs live in the jsii node process started by the first CDK
+    # import, its high water mark is read from /proc where available
+    peak = 0
+    try:
+        for task in os.listdir('/proc/self/task'):
+            with open('/proc/self/task/{}/children'.format(task)) as children:
+                for pid in children.read().split():
+                    with open('/proc/{}/status'.format(pid)) as status:
+                        for line in status:
+                            if line.startswith('VmHWM:'):
+                                peak = max(peak, int(line.split()[1]))
+    except OSError:
+        return None
+    return peak / 1024 if peak else None
+
+
+def synth(groups, shards, shared_definitions, profile_path=None):
+    sys.path.insert(0, CODE_DIR)
+    from aws_cdk import core
+    from lib.greengrass import core_group_definition_stacks
+
+    deployment_parameter_sets = list(generate_fleet(groups))
+    outdir = tempfile.mkdtemp(prefix='synth-benchmark-')
+    profiler = cProfile.Profile() if profile_path else None
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    app = core.App(outdir=outdir)
+    core_group_definition_stacks(
+        app,
+        id="iot-gg-cicd-workshop-core-group-definition-versions-benchmark",
+        deployment_parameter_sets=deployment_parameter_sets,
+        shards=shards,
+        shared_definitions=shared_definitions,
+        env=core.Environment(account='123456789012', region='us-east-1'),
+    )
+    assembly = app.synth()
+    if profiler:
+        profiler.disable()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    template_bytes = 0
+    resources = 0
+    for stack in assembly.stacks:
+        # template_full_path is newer than the pinned CDK, the file name is
+        # relative to the assembly directory
+        template_bytes += os.path.getsize(os.path.join(assembly.directory, stack.template_file))
+        resources += len(stack.template.get('Resources', {}))
+
+    if profiler:
+        profiler.dump_stats(profile_path)
+
+    return {
+        'Groups': groups,
+        'Shards': shards,
+        'SharedDefinitions': shared_definitions,
+        'Seconds': elapsed,
+        'PythonPeakMB': peak / 1024 / 1024,
+        'ProcessMaxRssMB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'NodePeakMB': child_peak_rss_mb(),
+        'Stacks': len(assembly.stacks),
+        'Resources': resources,
+        'TemplateBytes': template_bytes,
+    }
+
+
+def run_isolated(groups, shards, shared_definitions, profile_path=None):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--groups', str(groups), '--shards', str(shards)]
+    if shared_definitions:
+        command.append('--shared-definitions')
+    if profile_path:
+        command.extend(['--profile', profile_path])
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_profile(profile_path, top):
+    stream = io.StringIO()
+    pstats.Stats(profile_path, stream=stream).sort_stats('cumulative').print_stats(top)
+    print(stream.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CDK synth of the core group definition stacks")
+    parser.add_argument('--groups', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--shards', type=int, default=0, help="stacks per fleet, 0 derives them like app.py")
+    parser.add_argument('--shard-size', type=int, default=64, help="groups per stack when the shards are derived")
+    parser.add_argument('--shared-definitions', action='store_true')
+    parser.add_argument('--profile', help="write the cProfile stats of the largest fleet to this file")
+    parser.add_argument('--top', type=int, default=25, help="hottest functions printed from the profile")
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(synth(args.groups[0], args.shards, args.shared_definitions, args.profile)))
+        return
+
+    results = []
+    largest = max(args.groups)
+    print('{:>8} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'groups', 'stacks', 'seconds', 'py MB', 'node MB', 'resources', 'KB', 'KB/group'))
+    for groups in args.groups:
+        shards = args.shards or max(1, math.ceil(groups / args.shard_size))
+        result = run_isolated(groups, shards, args.shared_definitions, args.profile if groups == largest else None)
+        results.append(result)
+        print('{Groups:>8} {Stacks:>7} {Seconds:>10.2f} {PythonPeakMB:>10.1f} {node:>10} {Resources:>10} {kb:>10.0f} {per_group:>12.2f}'.format(
+            node='{:.1f}'.format(result['NodePeakMB']) if result['NodePeakMB'] is not None else 'n/a',
+            kb=result['TemplateBytes'] / 1024,
+            per_group=result['TemplateBytes'] / 1024 / max(1, groups),
+            **result))
+
+    if args.profile:
+        print('Hottest functions synthesizing {} groups, full profile in {}'.format(largest, args.profile))
+        print_profile(args.profile, args.top)
+
+    if args.output:
+        with open(args.output, "w+") as json_file:
+            json_file.write(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import boto3
+import os
+import threading
+import time
+from botocore.config import Config
+
+# Requests per second allowed per API operation before a call waits for a
+# token. These are conservative starting points, they can be overridden per
+# call site or with AWS_API_RATES="GetGroup=20,CreateDeployment=5".
+DEFAULT_RATES = {
+    'greengrass': {
+        'CreateDeployment': 10,
+        'GetGroup': 20,
+        'GetGroupVersion': 20,
+        'GetCoreDefinitionVersion': 20,
+        'GetDeploymentStatus': 10,
+        'ListGroups': 5,
+        'ResetDeployments': 5,
+        'DeleteGroup': 5,
+        'CreateCoreDefinition': 10,
+        'CreateCoreDefinitionVersion': 10,
+        'CreateDeviceDefinition': 10,
+        'CreateDeviceDefinitionVersion': 10,
+        'CreateFunctionDefinition': 10,
+        'CreateFunctionDefinitionVersion': 10,
+        'CreateSubscriptionDefinition': 10,
+        'CreateSubscriptionDefinitionVersion': 10,
+        'CreateResourceDefinition': 10,
+        'CreateResourceDefinitionVersion': 10,
+        'CreateGroupVersion': 10,
+        'TagResource': 10,
+    },
+    'iot': {
+        'ListThings': 5,
+        'ListThingPrincipals': 10,
+        'DetachThingPrincipal': 10,
+        'DeleteThing': 10,
+        'UpdateCertificate': 10,
+        'DeleteCertificate': 10,
+    },
+    'resourcegroupstaggingapi': {
+        'GetResources': 5,
+    },
+}
+
+
+class TokenBucket:
+    # Thread safe token bucket, acquire blocks until a token is available
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_rates(value):
+    rates = {}
+    for item in filter(None, value.split(',')):
+        operation, rate = item.split('=')
+        rates[operation.strip()] = float(rate)
+    return rates
+
+
+def client(service_name, max_concurrency=10, rates=None, **kwargs):
+    # A boto3 client with adaptive retries on throttling, a connection pool
+    # large enough for max_concurrency threads and a token bucket per API
+    # operation. The buckets hook into before-call so paginators are
+    # throttled as well.
+    config = Config(
+        retries={'max_attempts': 10, 'mode': 'adaptive'},
+        max_pool_connections=max(10, max_concurrency),
+    )
+    service_client = boto3.client(service_name, config=config, **kwargs)
+
+    operation_rates = dict(DEFAULT_RATES.get(service_name, {}))
+    operation_rates.update(rates or {})
+    operation_rates.update(parse_rates(os.environ.get('AWS_API_RATES', '')))
+    buckets = {operation: TokenBucket(rate) for operation, rate in operation_rates.items() if rate}
+
+    def throttle(model, **kwargs):
+        bucket = buckets.get(model.name)
+        if bucket:
+            bucket.acquire()
+
+    service_client.meta.events.register('before-call', throttle)
+    return service_client
+
+
+class RegionalClients:
+    # Clients of one service per region, created with the settings of
+    # client() on first use. The None region is the default region of the
+    # session.
+    def __init__(self, service_name, **kwargs):
+        self.service_name = service_name
+        self.kwargs = kwargs
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def get(self, region=None):
+        with self.lock:
+            if region not in self.clients:
+                kwargs = dict(self.kwargs, region_name=region) if region else self.kwargs
+                self.clients[region] = client(self.service_name, **kwargs)
+            return self.clients[region]
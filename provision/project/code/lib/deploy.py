@@ -1,93 +1,448 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: MIT-0
 
-import boto3
+import heapq
+import itertools
 import json
+import math
 import os
-import sys
+import queue
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-Path("out").mkdir(parents=True, exist_ok=True)
+from aws_clients import RegionalClients, client
+from deploy_checkpoint import Checkpoint
+from deploy_events import DeploymentEventTracker, SqsEventSource
+from deploy_metrics import DeploymentMetrics
+from function_arns import FunctionArns, arn_region
+from group_hash import DEPLOYED_HASH_TAG, group_hash, resolve_function_version
+from manifest import read_manifest
+
 PARAMETER_FILE = os.environ.get('PARAMETER_FILE','deploy_params.json')
 FAILURES_FILE = os.environ.get('FAILURES_FILE','out/deployment_failures.json')
-tagging_client = boto3.client('resourcegroupstaggingapi')
-gg_client = boto3.client('greengrass')
+REPORT_FILE = os.environ.get('DEPLOY_REPORT_FILE','out/deployment_report.json')
+FLEET = os.environ.get('DEPLOY_FLEET','default')
+DEPLOY_WORKERS = int(os.environ.get('DEPLOY_WORKERS','16'))
+DEPLOY_TIMEOUT = float(os.environ.get('DEPLOY_TIMEOUT','900'))
+POLL_RATE = float(os.environ.get('DEPLOY_POLL_RATE','10'))
+POLL_INITIAL_DELAY = float(os.environ.get('DEPLOY_POLL_INITIAL_DELAY','1'))
+POLL_MAX_DELAY = float(os.environ.get('DEPLOY_POLL_MAX_DELAY','30'))
+WAVE_SIZE = os.environ.get('DEPLOY_WAVE_SIZE','')
+FAILURE_THRESHOLD = float(os.environ.get('DEPLOY_FAILURE_THRESHOLD','1.0'))
+RESET_ON_FAILURE = os.environ.get('DEPLOY_RESET_ON_FAILURE','false').lower() == 'true'
+EVENT_QUEUE_URL = os.environ.get('DEPLOY_EVENT_QUEUE_URL','')
+EVENT_GRACE = float(os.environ.get('DEPLOY_EVENT_GRACE','120'))
+VERIFY_SAMPLE = int(os.environ.get('DEPLOY_VERIFY_SAMPLE','5'))
+CHECKPOINT_FILE = os.environ.get('DEPLOY_CHECKPOINT_FILE','out/deploy_checkpoint.json')
+CHECKPOINT_BUCKET = os.environ.get('DEPLOY_CHECKPOINT_BUCKET','')
+CHECKPOINT_KEY = os.environ.get('DEPLOY_CHECKPOINT_KEY','checkpoints/{}.json'.format(FLEET))
+RESUME = os.environ.get('DEPLOY_RESUME','false').lower() == 'true'
+METRICS_CLOUDWATCH = os.environ.get('DEPLOY_METRICS_CLOUDWATCH','false').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('DEPLOY_METRICS_NAMESPACE','iot-gg-cicd-workshop/Deployments')
+# Lambda version or alias ARN the groups pin, enables skipping unchanged groups
+# Comma separated, at most one ARN per region. Regions without one read the
+# parameter from SSM of the region.
+FUNCTION_ARNS = [arn for arn in os.environ.get('DEPLOY_FUNCTION_ARN','').split(',') if arn]
+FUNCTION_PARAMETER = os.environ.get('DEPLOY_FUNCTION_PARAMETER','')
+SKIP_UNCHANGED = os.environ.get('DEPLOY_SKIP_UNCHANGED','true').lower() == 'true'
+# Regions whose groups are deployed, empty for all. The targets deploying
+# the core group definition stacks set it to the synth region, groups of
+# other regions have no new group version.
+REGIONS = [region.strip() for region in os.environ.get('DEPLOY_REGIONS','').split(',') if region.strip()]
+# Telemetry aggregation function the groups pin, when they run it
+TELEMETRY_FUNCTION_ARNS = [arn for arn in os.environ.get('DEPLOY_TELEMETRY_FUNCTION_ARN','').split(',') if arn]
+TELEMETRY_FUNCTION_PARAMETER = os.environ.get('DEPLOY_TELEMETRY_FUNCTION_PARAMETER','')
 
-try:
-    with open(PARAMETER_FILE, "r+") as json_file:
-        deployment_parameter_sets = json.load(json_file)
-except FileNotFoundError:
-    deployment_parameter_sets = []
 
-deployments = {}
+class RegionalGreengrass:
+    # Greengrass client that sends every per group call to the client of the
+    # region recorded for the group in the manifest. Groups without a Region
+    # use the default region.
+    def __init__(self, clients):
+        self.clients = clients
+        self.regions = {}
 
-for deployment_parameter_set in deployment_parameter_sets:
+    def route(self, deployment_parameter_sets):
+        for deployment_parameter_set in deployment_parameter_sets:
+            self.regions[deployment_parameter_set['GroupId']] = deployment_parameter_set.get('Region')
+            yield deployment_parameter_set
 
-    group_id = deployment_parameter_set['GroupId']
+    def __getattr__(self, operation_name):
+        def call(**kwargs):
+            if 'ResourceArn' in kwargs:
+                region = kwargs['ResourceArn'].split(':')[3]
+            else:
+                region = self.regions.get(kwargs.get('GroupId'))
+            regional_client = self.clients.get(region)
+            return getattr(regional_client, operation_name)(**kwargs)
+        return call
+
+
+def resolve_group_version(gg_client, group_id):
     group = gg_client.get_group(GroupId=group_id)
 
     group_version = gg_client.get_group_version(
         GroupId=group_id,
         GroupVersionId=group['LatestVersion']
         )
+    return group_version['Version']
+
+
+def verify_group_versions(gg_client, deployment_parameter_sets, sample_size=VERIFY_SAMPLE):
+    # Spot check the versions recorded by deployment_targets.py --refresh
+    # against the service, a stale file makes us resolve every group again
+    recorded = [p for p in deployment_parameter_sets if p.get('GroupVersionId')]
+    for deployment_parameter_set in random.sample(recorded, min(sample_size, len(recorded))):
+        group = gg_client.get_group(GroupId=deployment_parameter_set['GroupId'])
+        if group['LatestVersion'] != deployment_parameter_set['GroupVersionId']:
+            print('GroupId {} recorded version {} is not the latest {}, resolving all group versions'.format(
+                deployment_parameter_set['GroupId'], deployment_parameter_set['GroupVersionId'], group['LatestVersion']))
+            return False
+    return True
+
+
+def create_deployment(gg_client, deployment_parameter_set, trust_recorded=True):
+    group_id = deployment_parameter_set['GroupId']
+    group_version_id = deployment_parameter_set.get('GroupVersionId') if trust_recorded else None
+    if not group_version_id:
+        group_version_id = resolve_group_version(gg_client, group_id)
 
-    group_version_id = group_version['Version']
     deployment = gg_client.create_deployment(
         DeploymentType='NewDeployment',
         GroupId=group_id,
         GroupVersionId=group_version_id,
         )
+    deployment['GroupVersionId'] = group_version_id
+    return deployment
+
+
+def create_deployments(gg_client, deployment_parameter_sets, workers=DEPLOY_WORKERS, trust_recorded=True, metrics=None, checkpoint=None, hashes=None):
+    # Fan the per group calls out over a bounded pool, the map keeps the
+    # order of the parameter file and re-raises the first failed call. Every
+    # deployment is checkpointed with its group hash as soon as it is
+    # created, so a resume after a failed call does not create it again.
+    def timed_create_deployment(deployment_parameter_set):
+        started = time.monotonic()
+        deployment = create_deployment(gg_client, deployment_parameter_set, trust_recorded)
+        if metrics:
+            metrics.created(deployment_parameter_set['GroupId'], started, time.monotonic())
+        if checkpoint:
+            checkpoint.record(deployment_parameter_set['GroupId'], DeploymentId=deployment['DeploymentId'],
+                DeploymentArn=deployment.get('DeploymentArn'), GroupVersionId=deployment['GroupVersionId'], Status='Created',
+                GroupHash=(hashes or {}).get(deployment_parameter_set['GroupId']))
+        return deployment
+
+    group_ids = [deployment_parameter_set['GroupId'] for deployment_parameter_set in deployment_parameter_sets]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = executor.map(timed_create_deployment, deployment_parameter_sets)
+        return dict(zip(group_ids, results))
+
+
+def next_poll_delay(attempt):
+    # Exponential backoff with jitter, so deployments created together do
+    # not keep polling in lock step
+    delay = min(POLL_MAX_DELAY, POLL_INITIAL_DELAY * (2 ** attempt))
+    return random.uniform(delay / 2, delay)
+
+
+def get_deployment_status(gg_client, group_id, deployment):
+    return gg_client.get_deployment_status(
+        GroupId=group_id,
+        DeploymentId=deployment['DeploymentId'],
+    )
+
+
+def wait_for_deployments(gg_client, deployments, deadline, tracker=None, checkpoint=None, metrics=None, workers=DEPLOY_WORKERS):
+    # Returns the failures and the deployments still pending at the deadline.
+    # With an event tracker groups are only polled once no event arrived
+    # within EVENT_GRACE, a Failure event triggers one poll for the details.
+    deployments = dict(deployments)
+    failed = []
+
+    first_poll = EVENT_GRACE if tracker else 0
+    # (next poll time, attempt, group id) for every outstanding deployment,
+    # entries of groups completed through events are skipped when popped
+    schedule = [(time.monotonic() + first_poll + next_poll_delay(0), 0, group_id) for group_id in deployments]
+    heapq.heapify(schedule)
+    if tracker:
+        tracker.track(deployments)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while deployments:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+
+            if tracker:
+                try:
+                    wait = max(0, min(schedule[0][0] if schedule else deadline, deadline) - now)
+                    group_id, status = tracker.statuses.get(timeout=wait)
+                except queue.Empty:
+                    pass
+                else:
+                    if group_id not in deployments:
+                        continue
+                    if metrics:
+                        metrics.status(group_id, status)
+                    if status == 'Success':
+                        print('GroupId {} Status: {}'.format(group_id,status ))
+                        del deployments[group_id]
+                        if checkpoint:
+                            checkpoint.record(group_id, Status=status)
+                    elif status == 'Failure':
+                        heapq.heappush(schedule, (time.monotonic(), 0, group_id))
+                    continue
+            elif schedule[0][0] > now:
+                time.sleep(min(schedule[0][0], deadline) - now)
+                continue
+
+            due = {}
+            while schedule and schedule[0][0] <= now:
+                _, attempt, group_id = heapq.heappop(schedule)
+                if group_id in deployments:
+                    due.setdefault(group_id, attempt)
+
+            futures = [
+                (attempt, group_id, executor.submit(get_deployment_status, gg_client, group_id, deployments[group_id]))
+                for group_id, attempt in due.items()
+            ]
+            for attempt, group_id, future in futures:
+                deployment_status = future.result()
+                status = deployment_status['DeploymentStatus']
+                print('GroupId {} Status: {}'.format(group_id,status ))
+                if checkpoint:
+                    checkpoint.record(group_id, Status=status)
+                if metrics:
+                    metrics.status(group_id, status)
+
+                if status == 'Success':
+                    del deployments[group_id]
+
+                elif status == 'Failure':
+                    del deployments[group_id]
+                    failed.append(
+                        {group_id:
+                            {
+                                'ErrorMessage': deployment_status['ErrorMessage'],
+                                'ErrorDetails': deployment_status['ErrorDetails'],
+                            }
+                        })
+                else:
+                    heapq.heappush(schedule, (time.monotonic() + next_poll_delay(attempt + 1), attempt + 1, group_id))
+
+    return failed, deployments
+
+
+def split_waves(deployment_parameter_sets, wave_size=WAVE_SIZE):
+    # The wave size is either a number of groups or a percentage of the fleet.
+    # Waves of a fixed size are taken from the manifest as they are needed,
+    # a percentage or a single wave needs the whole fleet up front.
+    if wave_size and not wave_size.endswith('%'):
+        size = max(1, int(wave_size))
+        deployment_parameter_sets = iter(deployment_parameter_sets)
+        wave = list(itertools.islice(deployment_parameter_sets, size))
+        while wave:
+            yield wave
+            wave = list(itertools.islice(deployment_parameter_sets, size))
+        return
+    deployment_parameter_sets = list(deployment_parameter_sets)
+    if not wave_size:
+        yield deployment_parameter_sets
+        return
+    size = max(1, math.ceil(len(deployment_parameter_sets) * float(wave_size[:-1]) / 100))
+    for i in range(0, len(deployment_parameter_sets), size):
+        yield deployment_parameter_sets[i:i + size]
+
+
+def reset_deployments(gg_client, group_ids, workers=DEPLOY_WORKERS):
+    for group_id in group_ids:
+        print('Resetting deployments for GroupId {}'.format(group_id))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(lambda group_id: gg_client.reset_deployments(Force=True, GroupId=group_id), group_ids))
+
+
+def record_deployed_hashes(gg_client, deployments, hashes, workers=DEPLOY_WORKERS):
+    # Tag the groups with the hash of what was deployed. The group ARN is
+    # the prefix of the deployment ARN, groups resumed without one are
+    # looked up.
+    def tag_group(group_id):
+        deployment_arn = (deployments[group_id] or {}).get('DeploymentArn')
+        if deployment_arn:
+            group_arn = deployment_arn.split('/deployments/')[0]
+        else:
+            group_arn = gg_client.get_group(GroupId=group_id)['Arn']
+        gg_client.tag_resource(
+            ResourceArn=group_arn,
+            tags={DEPLOYED_HASH_TAG: hashes[group_id]},
+        )
+
+    group_ids = [group_id for group_id in deployments if group_id in hashes]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(tag_group, group_ids))
+
+
+def rollout(gg_client, deployment_parameter_sets, tracker=None, checkpoint=None, resume=False, metrics=None, function_version_arn=None, telemetry_version_arn=None, regions=REGIONS, function_version_arns=None, telemetry_version_arns=None):
+    # Deploy wave by wave and stop once the failure rate of the groups
+    # deployed so far crosses FAILURE_THRESHOLD. When resuming, groups that
+    # already succeeded are skipped and groups still in progress are polled
+    # instead of deployed again. With the function version known, groups
+    # whose hash matches the one of their last deployment are skipped. The
+    # version ARNs are either one for every group or, in the *_arns, one per
+    # region.
+    waves = split_waves(deployment_parameter_sets, WAVE_SIZE)
+    wave = next(waves, None)
+    # The recorded versions are spot checked against the first wave
+    trust_recorded = verify_group_versions(gg_client, wave or [], VERIFY_SAMPLE)
+    failed = []
+    pending = {}
+    deployed = 0
+    unchanged = 0
+    other_regions = 0
+    wave_number = 0
+    # Skipping relies on the recorded group versions being current
+    versioned = function_version_arn or function_version_arns
+    skip_unchanged = SKIP_UNCHANGED and versioned and trust_recorded
+
+    def version_arns(region):
+        return (
+            function_version_arns.get(region) if function_version_arns else function_version_arn,
+            telemetry_version_arns.get(region) if telemetry_version_arns else telemetry_version_arn,
+        )
+
+    while wave is not None:
+        wave_number += 1
+        if WAVE_SIZE:
+            print('Deploying wave {} ({} groups)'.format(wave_number, len(wave)))
+        to_deploy = []
+        deployments = {}
+        # Succeeded in an earlier run, tagged together with this wave
+        done = {}
+        hashes = {}
+        for deployment_parameter_set in wave:
+            region = deployment_parameter_set.get('Region')
+            if regions and region and region not in regions:
+                print('GroupId {} Status: Skipped (region {})'.format(deployment_parameter_set['GroupId'], region))
+                other_regions += 1
+                continue
+            if versioned:
+                hashes[deployment_parameter_set['GroupId']] = group_hash(deployment_parameter_set, *version_arns(region))
+            # Checkpoint entries of another function version are deployed
+            # again, so only groups deployed with their current hash are
+            # tagged with it
+            state = checkpoint.resume_state(deployment_parameter_set, hashes.get(deployment_parameter_set['GroupId'])) if checkpoint and resume else None
+            if skip_unchanged and deployment_parameter_set.get('DeployedHash') == hashes[deployment_parameter_set['GroupId']]:
+                print('GroupId {} Status: Unchanged'.format(deployment_parameter_set['GroupId']))
+                unchanged += 1
+            elif state == 'done':
+                print('GroupId {} Status: Success (checkpoint)'.format(deployment_parameter_set['GroupId']))
+                done[deployment_parameter_set['GroupId']] = None
+            elif state:
+                deployments[deployment_parameter_set['GroupId']] = state
+            else:
+                to_deploy.append(deployment_parameter_set)
+
+        try:
+            created = create_deployments(gg_client, to_deploy, trust_recorded=trust_recorded, metrics=metrics, checkpoint=checkpoint, hashes=hashes)
+        finally:
+            if checkpoint:
+                checkpoint.flush()
+        deployments.update(created)
+
+        # Every wave gets the full timeout once its deployments are created
+        deadline = time.monotonic() + DEPLOY_TIMEOUT
+        wave_failed, pending = wait_for_deployments(gg_client, deployments, deadline, tracker, checkpoint, metrics)
+        failed.extend(wave_failed)
+        deployed += len(deployments)
+        if hashes:
+            failed_group_ids = set(group_id for failure in wave_failed for group_id in failure)
+            succeeded = dict(
+                (group_id, deployment) for group_id, deployment in deployments.items()
+                if group_id not in pending and group_id not in failed_group_ids
+            )
+            succeeded.update(done)
+            record_deployed_hashes(gg_client, succeeded, hashes)
+        if checkpoint:
+            checkpoint.flush()
 
-    deployments[group_id] = deployment
-    
-done_deployments = []
-failed = []
+        if len(pending) > 0:
+            break
 
-for i in range(100):
-    for group_id, deployment in deployments.items():
+        next_wave = next(waves, None)
+        if next_wave is not None and deployed and len(failed) / deployed > FAILURE_THRESHOLD:
+            print('Failure rate {:.1%} crossed the threshold, stopping rollout after wave {}'.format(
+                len(failed) / deployed, wave_number))
+            if RESET_ON_FAILURE:
+                reset_deployments(gg_client, [group_id for failure in wave_failed for group_id in failure])
+            failed.append('ABORTED')
+            break
+        wave = next_wave
 
-        deployment_status = gg_client.get_deployment_status(
-            GroupId=group_id,
-            DeploymentId=deployment['DeploymentId'],
+    if unchanged:
+        print('Skipped {} unchanged groups'.format(unchanged))
+    if other_regions:
+        print('Skipped {} groups outside {}'.format(other_regions, ', '.join(regions)))
+
+    if len(failed) > 0:
+        print('Deployment Failed: {}'.format(failed))
+
+    if len(failed) == 0 and len(pending.items()) == 0:
+        print('Deployment Success')
+
+    if len(pending.items()) > 0:
+        print('Deployment timedout')
+        failed.append('TIMEOUT')
+
+    return failed
+
+
+def main():
+    Path("out").mkdir(parents=True, exist_ok=True)
+    # The status polls share the GetDeploymentStatus bucket of the client of
+    # their region
+    gg_client = RegionalGreengrass(RegionalClients('greengrass', max_concurrency=DEPLOY_WORKERS, rates={'GetDeploymentStatus': POLL_RATE}))
+
+    tracker = None
+    if EVENT_QUEUE_URL:
+        tracker = DeploymentEventTracker(SqsEventSource(client('sqs'), EVENT_QUEUE_URL)).start()
+
+    # The manifest is read as the waves are deployed
+    deployment_parameter_sets = gg_client.route(read_manifest(PARAMETER_FILE)) if os.path.exists(PARAMETER_FILE) else []
+
+    checkpoint = Checkpoint(CHECKPOINT_FILE,
+        s3_client=client('s3') if CHECKPOINT_BUCKET else None,
+        bucket=CHECKPOINT_BUCKET,
+        key=CHECKPOINT_KEY,
         )
+    if RESUME:
+        checkpoint.load()
+    metrics = DeploymentMetrics()
+    # Aliases are resolved with the Lambda client of their region
+    lambda_clients = RegionalClients('lambda')
+    ssm_clients = RegionalClients('ssm')
+
+    def resolve(function_arn):
+        return resolve_function_version(lambda_clients.get(arn_region(function_arn)), function_arn)
+
+    function_version_arns = FunctionArns(FUNCTION_ARNS, FUNCTION_PARAMETER, ssm_clients, resolve)
+    telemetry_version_arns = FunctionArns(TELEMETRY_FUNCTION_ARNS, TELEMETRY_FUNCTION_PARAMETER, ssm_clients, resolve)
+
+    try:
+        failed = rollout(gg_client, deployment_parameter_sets, tracker, checkpoint, RESUME, metrics=metrics,
+            function_version_arns=function_version_arns or None, telemetry_version_arns=telemetry_version_arns or None)
+    finally:
+        if tracker:
+            tracker.stop()
+        checkpoint.flush()
+        metrics.write(REPORT_FILE)
+        if METRICS_CLOUDWATCH:
+            metrics.put_metrics(client('cloudwatch'), METRICS_NAMESPACE, FLEET)
+
+    f = open(FAILURES_FILE, "w+")
+    f.write(json.dumps(failed))
+    f.close()
+
 
-        status = deployment_status['DeploymentStatus']
-        print('GroupId {} Status: {}'.format(group_id,status ))
-
-        if status == 'Success':
-            done_deployments.append(group_id)
-
-        elif status == 'Failure':
-            done_deployments.append(group_id)
-            failed.append(
-                {group_id:
-                    {
-                        'ErrorMessage': deployment_status['ErrorMessage'],
-                        'ErrorDetails': deployment_status['ErrorDetails'],
-                    }
-                })
-        
-    for done_deployment in done_deployments:
-        del deployments[done_deployment]
-    done_deployments = []
-        
-    if len(deployments.items()) == 0:
-        break
-
-    time.sleep(1.0)
-
-if len(failed) > 0:
-    print('Deployment Failed: {}'.format(failed))
-
-if len(failed) == 0 and len(deployments.items()) == 0:
-    print('Deployment Success')
-
-if len(deployments.items()) > 0:
-    print('Deployment timedout')
-    failed.append('TIMEOUT')
-
-
-f = open(FAILURES_FILE, "w+")
-f.write(json.dumps(failed))
-f.close()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
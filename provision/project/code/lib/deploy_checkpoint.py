@@ -0,0 +1,84 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import threading
+import time
+from botocore.exceptions import ClientError
+
+PENDING_STATUSES = ('Created', 'Building', 'InProgress')
+
+
+class Checkpoint:
+    # Per group deployment id, group version and status of a rollout. The
+    # file is rewritten at most every interval seconds and on flush, and is
+    # optionally copied to a (versioned) S3 bucket so a rerun in a fresh
+    # CodeBuild container can resume from it.
+    def __init__(self, path, s3_client=None, bucket=None, key=None, interval=30):
+        self.path = path
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.interval = interval
+        self.groups = {}
+        self.saved = time.monotonic()
+        self.lock = threading.Lock()
+        # Records from the create workers may trigger concurrent flushes
+        self.flush_lock = threading.Lock()
+
+    def load(self):
+        if self.bucket:
+            try:
+                self.s3_client.download_file(self.bucket, self.key, self.path)
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise e
+                print('No checkpoint at s3://{}/{}'.format(self.bucket, self.key))
+        try:
+            with open(self.path, "r") as json_file:
+                self.groups = json.load(json_file)
+        except FileNotFoundError:
+            self.groups = {}
+        return self
+
+    def record(self, group_id, **fields):
+        with self.lock:
+            self.groups.setdefault(group_id, {}).update(fields)
+            due = time.monotonic() - self.saved >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                data = json.dumps(self.groups)
+                self.saved = time.monotonic()
+            # Write next to the checkpoint and rename, a killed build never
+            # leaves a truncated file behind
+            tmp_path = '{}.tmp'.format(self.path)
+            with open(tmp_path, "w") as json_file:
+                json_file.write(data)
+            os.replace(tmp_path, self.path)
+            if self.bucket:
+                self.s3_client.upload_file(self.path, self.bucket, self.key)
+
+    def resume_state(self, deployment_parameter_set, group_hash=None):
+        # 'done' for groups that already succeeded with this version, the
+        # previous deployment for groups still in progress, None otherwise.
+        # The group version of the stacks stays the same across Lambda
+        # releases, with group_hash known the entry must also have been
+        # deployed with that hash.
+        entry = self.groups.get(deployment_parameter_set['GroupId'])
+        if not entry:
+            return None
+        group_version_id = deployment_parameter_set.get('GroupVersionId')
+        if group_version_id and entry.get('GroupVersionId') != group_version_id:
+            return None
+        if group_hash and entry.get('GroupHash') != group_hash:
+            return None
+        if entry.get('Status') == 'Success':
+            return 'done'
+        if entry.get('Status') in PENDING_STATUSES and entry.get('DeploymentId'):
+            return {'DeploymentId': entry['DeploymentId'], 'DeploymentArn': entry.get('DeploymentArn'), 'GroupVersionId': entry.get('GroupVersionId')}
+        return None
@@ -0,0 +1,126 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import queue
+import threading
+
+# EventBridge detail type of the events Greengrass emits for every
+# deployment status transition
+DEPLOYMENT_STATUS_CHANGE = 'Greengrass Deployment Status Change'
+TERMINAL_STATUSES = ('Success', 'Failure')
+
+
+class SqsEventSource:
+    # Deployment status change events routed to an SQS queue by an
+    # EventBridge rule. Messages are only deleted once they were matched to
+    # one of our deployments, so pipelines sharing the queue do not steal
+    # each others events.
+    def __init__(self, sqs_client, queue_url):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+
+    def receive(self, wait_seconds):
+        response = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=int(min(20, max(0, wait_seconds))),
+        )
+        return [(json.loads(message['Body']), message['ReceiptHandle']) for message in response.get('Messages', [])]
+
+    def acknowledge(self, receipts):
+        for i in range(0, len(receipts), 10):
+            self.sqs_client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(n), 'ReceiptHandle': receipt} for n, receipt in enumerate(receipts[i:i + 10])],
+            )
+
+
+class LocalEventSource:
+    # In process stand-in for the event queue, used by tests and benchmarks
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def put(self, event):
+        self.events.put(event)
+
+    def receive(self, wait_seconds):
+        try:
+            events = [(self.events.get(timeout=wait_seconds), None)]
+        except queue.Empty:
+            return []
+        while len(events) < 10:
+            try:
+                events.append((self.events.get_nowait(), None))
+            except queue.Empty:
+                break
+        return events
+
+    def acknowledge(self, receipts):
+        pass
+
+
+def deployment_status_change(group_id, deployment_id, status):
+    # Shape of the EventBridge event, as delivered to the queue
+    return {
+        'source': 'aws.greengrass',
+        'detail-type': DEPLOYMENT_STATUS_CHANGE,
+        'detail': {
+            'group-id': group_id,
+            'deployment-id': deployment_id,
+            'deployment-type': 'NewDeployment',
+            'status': status,
+        },
+    }
+
+
+class DeploymentEventTracker:
+    # Consumes deployment status change events on a background thread and
+    # hands the statuses of tracked deployments to the poller through the
+    # statuses queue
+    def __init__(self, source, wait_seconds=5):
+        self.source = source
+        self.wait_seconds = wait_seconds
+        self.statuses = queue.Queue()
+        self.tracked = {}
+        self.early = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def track(self, deployments):
+        with self.lock:
+            for group_id, deployment in deployments.items():
+                self.tracked[deployment['DeploymentId']] = group_id
+                # The event may have been consumed before the deployment was
+                # registered here
+                status = self.early.pop(deployment['DeploymentId'], None)
+                if status is not None:
+                    self.statuses.put((group_id, status))
+
+    def _run(self):
+        while not self.stopped.is_set():
+            receipts = []
+            for event, receipt in self.source.receive(self.wait_seconds):
+                if event.get('detail-type') != DEPLOYMENT_STATUS_CHANGE:
+                    continue
+                deployment_id = event['detail'].get('deployment-id')
+                status = event['detail'].get('status')
+                with self.lock:
+                    group_id = self.tracked.get(deployment_id)
+                    if group_id is None:
+                        if status in TERMINAL_STATUSES:
+                            self.early[deployment_id] = status
+                        continue
+                receipts.append(receipt)
+                self.statuses.put((group_id, status))
+            if receipts:
+                self.source.acknowledge(receipts)
@@ -0,0 +1,115 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import collections
+import datetime
+import json
+import math
+import threading
+import time
+
+TIMINGS = ('CreateSeconds', 'InProgressSeconds', 'CompletedSeconds')
+# PutMetricData takes at most 20 metrics per call and 150 values per metric
+METRIC_DATA_BATCH = 20
+METRIC_DATA_VALUES = 150
+
+
+def percentile(values, p):
+    # Nearest rank percentile of an already sorted list
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class DeploymentMetrics:
+    # Per group deployment timings, all relative to the moment the create
+    # call for the group was started:
+    #   CreateSeconds      until create_deployment returned
+    #   InProgressSeconds  until the deployment was first seen InProgress
+    #   CompletedSeconds   until a terminal status was seen
+    def __init__(self):
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def created(self, group_id, started, finished):
+        with self.lock:
+            self.groups[group_id] = {'Started': started, 'CreateSeconds': finished - started}
+
+    def status(self, group_id, status, at=None):
+        at = at or time.monotonic()
+        with self.lock:
+            group = self.groups.setdefault(group_id, {})
+            started = group.get('Started')
+            group['Status'] = status
+            if started is None:
+                return
+            if status == 'InProgress' and 'InProgressSeconds' not in group:
+                group['InProgressSeconds'] = at - started
+            if status in ('Success', 'Failure') and 'CompletedSeconds' not in group:
+                group['CompletedSeconds'] = at - started
+
+    def report(self, slowest=10):
+        with self.lock:
+            groups = {group_id: dict(group) for group_id, group in self.groups.items()}
+
+        summary = {}
+        for timing in TIMINGS:
+            values = sorted(group[timing] for group in groups.values() if timing in group)
+            summary[timing] = {
+                'Count': len(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+                'Max': values[-1] if values else None,
+            }
+
+        statuses = {}
+        for group in groups.values():
+            statuses[group.get('Status', 'Unknown')] = statuses.get(group.get('Status', 'Unknown'), 0) + 1
+
+        ranked = sorted(
+            (group_id for group_id, group in groups.items() if 'Started' in group),
+            key=lambda group_id: groups[group_id].get('CompletedSeconds', math.inf),
+            reverse=True,
+        )
+        return {
+            'Groups': len(groups),
+            'Statuses': statuses,
+            'Timings': summary,
+            'Slowest': [
+                dict({'GroupId': group_id, 'Status': groups[group_id].get('Status')},
+                     **{timing: groups[group_id].get(timing) for timing in TIMINGS})
+                for group_id in ranked[:slowest]
+            ],
+        }
+
+    def write(self, path, slowest=10):
+        with open(path, "w+") as json_file:
+            json_file.write(json.dumps(self.report(slowest), indent=2))
+
+    def metric_data(self, fleet, timestamp=None):
+        # The timings of the fleet as CloudWatch metric data, every distinct
+        # value, rounded to the millisecond, is sent once with its count
+        timestamp = timestamp or datetime.datetime.now(datetime.timezone.utc)
+        with self.lock:
+            groups = {group_id: dict(group) for group_id, group in self.groups.items()}
+        for timing in TIMINGS:
+            counts = collections.Counter(round(group[timing], 3) for group in groups.values() if timing in group)
+            values = sorted(counts)
+            for i in range(0, len(values), METRIC_DATA_VALUES):
+                yield {
+                    'MetricName': timing,
+                    'Dimensions': [{'Name': 'Fleet', 'Value': fleet}],
+                    'Timestamp': timestamp,
+                    'Values': values[i:i + METRIC_DATA_VALUES],
+                    'Counts': [counts[value] for value in values[i:i + METRIC_DATA_VALUES]],
+                    'Unit': 'Seconds',
+                }
+
+    def put_metrics(self, cloudwatch_client, namespace, fleet):
+        # Publishes the timings with PutMetricData, returns the number of
+        # metrics sent
+        metric_data = list(self.metric_data(fleet))
+        for i in range(0, len(metric_data), METRIC_DATA_BATCH):
+            cloudwatch_client.put_metric_data(Namespace=namespace, MetricData=metric_data[i:i + METRIC_DATA_BATCH])
+        return len(metric_data)
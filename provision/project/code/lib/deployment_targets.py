@@ -1,56 +1,198 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: MIT-0
 
-import boto3
-import json
+import argparse
+import collections
 import os
-import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_clients import RegionalClients, client
+from discovery_cache import DiscoveryCache
+from group_hash import DEFINITION_HASH_TAG, DEPLOYED_HASH_TAG
+from manifest import read_manifest, write_manifest
 
-deployment_fleet = sys.argv[1]
 GROUP_CONFIG_FILE = os.environ.get('GROUP_CONFIG_FILE','gg_group_config.json')
-tagging_client = boto3.client('resourcegroupstaggingapi')
-gg_client = boto3.client('greengrass')
-
-# Get all the Greengrass group with the specific fleet tag
-results = tagging_client.get_paginator('get_resources').paginate(
-    TagFilters=[
-        {
-            'Key': 'fleet',
-            'Values': [
-                deployment_fleet,
-            ],
-        },
-    ],
-    ResourceTypeFilters=['greengrass:groups'],
-    PaginationConfig={
-        'MaxItems': 10000,
-    }
-)
-
-# Generate the configuration file
-deployment_parameter_sets = []
-for result in results:
-    for resource in result['ResourceTagMappingList']:
-        deployment_parameter_set = {}
-        group_arn = resource['ResourceARN']
-        group_id = group_arn.split('/')[-1]
+PARAMETER_FILE = os.environ.get('PARAMETER_FILE','deploy_params.json')
+DISCOVERY_WORKERS = int(os.environ.get('DISCOVERY_WORKERS','16'))
+DISCOVERY_MODE = os.environ.get('DISCOVERY_MODE','list')
+DISCOVERY_CACHE_DIR = os.environ.get('DISCOVERY_CACHE_DIR','cache')
+DISCOVERY_CACHE_BUCKET = os.environ.get('DISCOVERY_CACHE_BUCKET','')
+# Comma separated regions to discover, empty for the default region only
+DISCOVERY_REGIONS = [region.strip() for region in os.environ.get('DISCOVERY_REGIONS','').split(',') if region.strip()]
+
+
+def list_groups_by_id(gg_client):
+    # One list_groups call returns Name and LatestVersion for a whole page
+    # of groups
+    groups = {}
+    for page in gg_client.get_paginator('list_groups').paginate():
+        for group in page['Groups']:
+            groups[group['Id']] = group
+    return groups
+
+
+def resolve_group(gg_client, group_arn, cache=None, group=None):
+    deployment_parameter_set = {}
+    group_id = group_arn.split('/')[-1]
+    region = group_arn.split(':')[3]
+    if group is None or not group.get('LatestVersion'):
         group = gg_client.get_group(GroupId=group_id)
-        group_version = gg_client.get_group_version(
-            GroupId=group_id,
-            GroupVersionId=group['LatestVersion']
-            )
-        core_definition_version_arn = group_version['Definition']['CoreDefinitionVersionArn']
+    if cache:
+        cached = cache.get(group_arn, group['LatestVersion'])
+        if cached:
+            return dict(cached, GroupName=group['Name'], Region=region)
+    group_version = gg_client.get_group_version(
+        GroupId=group_id,
+        GroupVersionId=group['LatestVersion']
+        )
+    core_definition_version_arn = group_version['Definition']['CoreDefinitionVersionArn']
+    cached = cache.core_definition(group_arn, core_definition_version_arn) if cache else None
+    if cached:
+        thing_arn = cached['ThingArn']
+        cert_arn = cached['CertificateArn']
+    else:
         core_definition_version_id = core_definition_version_arn.split('/')[-3]
         core_definition_version_version = core_definition_version_arn.split('/')[-1]
         core_definition_version = gg_client.get_core_definition_version(
-            CoreDefinitionId=core_definition_version_id, 
+            CoreDefinitionId=core_definition_version_id,
             CoreDefinitionVersionId=core_definition_version_version,
             )
-        deployment_parameter_set['GroupId'] = group_id
-        deployment_parameter_set['GroupName'] = group['Name']
-        deployment_parameter_set['ThingArn'] = core_definition_version['Definition']['Cores'][0]['ThingArn']
-        deployment_parameter_set['CertificateArn'] = core_definition_version['Definition']['Cores'][0]['CertificateArn']
-        deployment_parameter_sets.append(deployment_parameter_set)
-f = open(GROUP_CONFIG_FILE, "w+")
-f.write(json.dumps(deployment_parameter_sets))
-f.close()
\ No newline at end of file
+        thing_arn = core_definition_version['Definition']['Cores'][0]['ThingArn']
+        cert_arn = core_definition_version['Definition']['Cores'][0]['CertificateArn']
+    deployment_parameter_set['GroupId'] = group_id
+    deployment_parameter_set['GroupName'] = group['Name']
+    deployment_parameter_set['GroupVersionId'] = group['LatestVersion']
+    deployment_parameter_set['ThingArn'] = thing_arn
+    deployment_parameter_set['CertificateArn'] = cert_arn
+    deployment_parameter_set['Region'] = region
+    if cache:
+        cache.put(group_arn, group['LatestVersion'], core_definition_version_arn, deployment_parameter_set)
+    return deployment_parameter_set
+
+
+def resolve_tagged_group(gg_client, resource, cache=None, group=None):
+    # The hashes of the last deployment and of the definitions created by
+    # greengrass_direct.py come with the tags of the group
+    deployment_parameter_set = resolve_group(gg_client, resource['ResourceARN'], cache, group)
+    tags = {tag['Key']: tag['Value'] for tag in resource.get('Tags', [])}
+    if DEPLOYED_HASH_TAG in tags:
+        deployment_parameter_set = dict(deployment_parameter_set, DeployedHash=tags[DEPLOYED_HASH_TAG])
+    if DEFINITION_HASH_TAG in tags:
+        deployment_parameter_set = dict(deployment_parameter_set, DefinitionHash=tags[DEFINITION_HASH_TAG])
+    return deployment_parameter_set
+
+
+def discover(tagging_client, gg_client, deployment_fleet, cache=None, mode=DISCOVERY_MODE):
+    # Get all the Greengrass group with the specific fleet tag
+    results = tagging_client.get_paginator('get_resources').paginate(
+        TagFilters=[
+            {
+                'Key': 'fleet',
+                'Values': [
+                    deployment_fleet,
+                ],
+            },
+        ],
+        ResourceTypeFilters=['greengrass:groups'],
+    )
+
+    # In list mode the groups are joined with a list_groups index instead of
+    # a get_group call per group, groups created after the listing are
+    # still looked up one by one
+    groups = list_groups_by_id(gg_client) if mode == 'list' else {}
+
+    # Resolve the groups on a bounded pool while the paginator is still
+    # fetching pages. Results are yielded in the order the tagging API
+    # returned them, so the generated file does not change between runs,
+    # and only a window of lookups is held in memory at any time.
+    window = max(1, DISCOVERY_WORKERS) * 4
+    with ThreadPoolExecutor(max_workers=max(1, DISCOVERY_WORKERS)) as executor:
+        futures = collections.deque()
+        for result in results:
+            for resource in result['ResourceTagMappingList']:
+                futures.append(executor.submit(resolve_tagged_group, gg_client, resource, cache, groups.get(resource['ResourceARN'].split('/')[-1])))
+                if len(futures) >= window:
+                    yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def discover_regions(tagging_clients, gg_clients, deployment_fleet, regions=DISCOVERY_REGIONS, cache=None, mode=DISCOVERY_MODE):
+    # Discover the fleet in every region concurrently. Each region is spooled
+    # to its own manifest so the merged output keeps the configured region
+    # order without holding the whole fleet in memory.
+    regions = regions or [None]
+    if len(regions) == 1:
+        yield from discover(tagging_clients.get(regions[0]), gg_clients.get(regions[0]), deployment_fleet, cache, mode)
+        return
+
+    with tempfile.TemporaryDirectory() as spool_dir:
+        def discover_region(region):
+            path = os.path.join(spool_dir, '{}.json'.format(region))
+            count = write_manifest(path,
+                discover(tagging_clients.get(region), gg_clients.get(region), deployment_fleet, cache, mode),
+                manifest_format='ndjson',
+                )
+            print('Discovered {} groups in {}'.format(count, region))
+            return path
+
+        with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+            paths = list(executor.map(discover_region, regions))
+        for path in paths:
+            yield from read_manifest(path)
+
+
+def refresh_group_versions(gg_clients, deployment_parameter_sets):
+    # The CDK deploy creates a new version for every group, list_groups
+    # returns the latest versions of a whole page of groups in one call.
+    # Each region in the manifest is listed once.
+    groups = {}
+
+    for deployment_parameter_set in deployment_parameter_sets:
+        region = deployment_parameter_set.get('Region')
+        if region not in groups:
+            groups[region] = list_groups_by_id(gg_clients.get(region))
+        group_version_id = groups[region].get(deployment_parameter_set['GroupId'], {}).get('LatestVersion')
+        if group_version_id:
+            deployment_parameter_set['GroupVersionId'] = group_version_id
+        else:
+            deployment_parameter_set.pop('GroupVersionId', None)
+        yield deployment_parameter_set
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Discover the Greengrass groups of a fleet")
+    parser.add_argument('fleet', nargs='?', help="fleet tag value to generate {} for".format(GROUP_CONFIG_FILE))
+    parser.add_argument('--refresh', action='store_true', help="update the group versions recorded in {}".format(PARAMETER_FILE))
+    args = parser.parse_args()
+
+    gg_clients = RegionalClients('greengrass', max_concurrency=DISCOVERY_WORKERS)
+
+    if args.refresh:
+        if not os.path.exists(PARAMETER_FILE):
+            print('No {} to refresh'.format(PARAMETER_FILE))
+            return
+        deployment_parameter_sets = refresh_group_versions(gg_clients, read_manifest(PARAMETER_FILE))
+        write_manifest(PARAMETER_FILE, deployment_parameter_sets)
+    elif args.fleet:
+        tagging_clients = RegionalClients('resourcegroupstaggingapi')
+        cache = None
+        if DISCOVERY_CACHE_DIR:
+            cache = DiscoveryCache(
+                os.path.join(DISCOVERY_CACHE_DIR, 'discovery_{}.json'.format(args.fleet)),
+                s3_client=client('s3') if DISCOVERY_CACHE_BUCKET else None,
+                bucket=DISCOVERY_CACHE_BUCKET,
+                key='discovery-cache/{}.json'.format(args.fleet),
+                ).load()
+        # Entries are written out as they are resolved
+        count = write_manifest(GROUP_CONFIG_FILE, discover_regions(tagging_clients, gg_clients, args.fleet, DISCOVERY_REGIONS, cache),
+            Fleet=args.fleet, Regions=DISCOVERY_REGIONS)
+        if cache:
+            print('Resolved {} groups, {} from the discovery cache'.format(count, cache.hits))
+            cache.save()
+    else:
+        parser.error("a fleet or --refresh is required")
+
+if __name__ == '__main__':
+    main()
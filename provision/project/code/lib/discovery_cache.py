@@ -0,0 +1,74 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import threading
+from botocore.exceptions import ClientError
+
+
+class DiscoveryCache:
+    # Resolved deployment parameter sets keyed by group ARN, together with
+    # the group version and core definition version they were resolved from.
+    # Only the groups looked up during a run are saved, so groups that lost
+    # the fleet tag drop out of the cache. The file is optionally synced with
+    # an S3 object so fresh CodeBuild containers start warm.
+    def __init__(self, path, s3_client=None, bucket=None, key=None):
+        self.path = path
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.entries = {}
+        self.seen = {}
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.bucket:
+            try:
+                self.s3_client.download_file(self.bucket, self.key, self.path)
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise e
+        try:
+            with open(self.path, "r") as json_file:
+                self.entries = json.load(json_file)
+        except FileNotFoundError:
+            self.entries = {}
+        return self
+
+    def get(self, group_arn, latest_version):
+        entry = self.entries.get(group_arn)
+        if entry and entry['LatestVersion'] == latest_version:
+            with self.lock:
+                self.hits += 1
+                self.seen[group_arn] = entry
+            return entry['DeploymentParameterSet']
+        return None
+
+    def core_definition(self, group_arn, core_definition_version_arn):
+        # A new group version usually still points at the same core
+        # definition version, the core details can be reused then
+        entry = self.entries.get(group_arn)
+        if entry and entry['CoreDefinitionVersionArn'] == core_definition_version_arn:
+            return entry['DeploymentParameterSet']
+        return None
+
+    def put(self, group_arn, latest_version, core_definition_version_arn, deployment_parameter_set):
+        with self.lock:
+            self.seen[group_arn] = {
+                'LatestVersion': latest_version,
+                'CoreDefinitionVersionArn': core_definition_version_arn,
+                'DeploymentParameterSet': deployment_parameter_set,
+            }
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            data = json.dumps(self.seen)
+        with open(self.path, "w+") as json_file:
+            json_file.write(data)
+        if self.bucket:
+            self.s3_client.upload_file(self.path, self.bucket, self.key)
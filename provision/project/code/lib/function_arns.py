@@ -0,0 +1,44 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import threading
+
+
+def arn_region(arn):
+    return arn.split(':')[3]
+
+
+class FunctionArns:
+    # The ARN of one Lambda function per region, the cores of a region can
+    # only run a function of that region. ARNs given up front are keyed by
+    # the region in the ARN, the ARN of any other region is read on first use
+    # from parameter_name in SSM of that region, where the function stacks of
+    # the region write it. resolve is applied to every ARN once. The None
+    # region, groups of a manifest without regions, takes the only ARN given
+    # or the parameter of the default region.
+    def __init__(self, arns=(), parameter_name=None, ssm_clients=None, resolve=None):
+        self.given = dict((arn_region(arn), arn) for arn in arns if arn)
+        self.parameter_name = parameter_name
+        self.ssm_clients = ssm_clients
+        self.resolve = resolve
+        self.arns = {}
+        self.lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.given or self.parameter_name)
+
+    def _lookup(self, region):
+        if region in self.given:
+            return self.given[region]
+        if region is None and len(self.given) == 1 and not self.parameter_name:
+            return next(iter(self.given.values()))
+        if not self.parameter_name:
+            raise ValueError('No function ARN for region {}, pass one ARN per region or the SSM parameter holding them'.format(region))
+        return self.ssm_clients.get(region).get_parameter(Name=self.parameter_name, WithDecryption=True)['Parameter']['Value']
+
+    def get(self, region=None):
+        with self.lock:
+            if region not in self.arns:
+                arn = self._lookup(region)
+                self.arns[region] = self.resolve(arn) if self.resolve else arn
+            return self.arns[region]
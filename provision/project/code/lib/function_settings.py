@@ -0,0 +1,54 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import os
+
+# Disk spool settings shared by both functions, see src/lambda/spool.py
+SPOOL_SETTINGS = (
+    'SPOOL_WRITES',
+    'SPOOL_DIR',
+    'SPOOL_MAX_BYTES',
+    'SPOOL_SEGMENT_BYTES',
+    'SPOOL_SYNC_EVERY',
+    'SPOOL_SLOW_MS',
+    'SPOOL_DRAIN_BATCH',
+    'SPOOL_DRAIN_INTERVAL_S',
+    'SPOOL_MAX_ATTEMPTS',
+    'SPOOL_VOLUME',
+)
+# Id of the local volume resource the spool is kept on
+SPOOL_RESOURCE_ID = 'spool'
+
+# Environment variables of the device shadow function that are passed
+# through from the deploy environment to every group's function definition
+FUNCTION_SETTINGS = (
+    'COALESCE_UPDATES',
+    'COALESCE_WINDOW_MS',
+    'COALESCE_MAX_PENDING',
+    'SUPPRESS_UNCHANGED',
+    'SUPPRESS_MAX_AGE_S',
+) + SPOOL_SETTINGS
+# Same for the telemetry aggregation function
+TELEMETRY_SETTINGS = (
+    'TELEMETRY_WINDOW_S',
+    'TELEMETRY_SLIDE_S',
+    'TELEMETRY_PERCENTILES',
+    'TELEMETRY_MAX_SAMPLES',
+) + SPOOL_SETTINGS
+
+
+def function_variables():
+    return dict((name, os.environ[name]) for name in FUNCTION_SETTINGS if name in os.environ)
+
+
+def telemetry_variables():
+    return dict((name, os.environ[name]) for name in TELEMETRY_SETTINGS if name in os.environ)
+
+
+def spool_volume():
+    # (source, destination) of the local volume resource mounting the host
+    # directory SPOOL_VOLUME at SPOOL_DIR in the function containers, so the
+    # spool outlives them. None when spooling is off.
+    if os.environ.get('SPOOL_WRITES', 'false').lower() != 'true':
+        return None
+    return os.environ.get('SPOOL_VOLUME', '/var/spool/greengrass'), os.environ.get('SPOOL_DIR', '/tmp/spool')
@@ -1,20 +1,22 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: MIT-0
 
+# Only the modules every stack needs are imported here, loading a CDK module
+# starts its jsii assembly and the core group stacks are synthesized on
+# their own
 from aws_cdk import (
     core,
-    aws_iot as iot,
-    custom_resources as cust_resource,
-    aws_lambda as awslambda,
-    aws_iam as iam,
     aws_greengrass as greengrass,
-    aws_ssm as ssm,
 )
 
-import uuid
+import math
+import zlib
+
+from lib.function_settings import SPOOL_RESOURCE_ID
 class LambdaFunction(core.Stack):
-    def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
+    def __init__(self, scope: core.Construct, id: str, telemetry: bool = False, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
+        from aws_cdk import aws_lambda as awslambda, aws_ssm as ssm
 
         self.lambda_code = awslambda.Code.asset("src/lambda") 
 
@@ -51,9 +53,48 @@ class LambdaFunction(core.Stack):
             string_value=canary_lambda_alias.function_arn,
             )
 
+        # Telemetry aggregation function, from the same asset. Only created
+        # when the groups run it, so the stack has no unused function.
+        if not telemetry:
+            return
+
+        telemetry_lambda = awslambda.Function(
+            self,
+            "TelemetryLambda",
+            runtime=awslambda.Runtime.PYTHON_3_7,
+            code=self.lambda_code,
+            handler="telemetry_aggregator.handler",
+            function_name="iot-gg-cicd-workshop-telemetry",
+        )
+
+        telemetry_version = telemetry_lambda.current_version
+
+        cfn_telemetry_version: awslambda.CfnVersion = telemetry_version.node.try_find_child("Resource")
+        cfn_telemetry_version.cfn_options.deletion_policy = core.CfnDeletionPolicy.RETAIN
+
+        canary_telemetry_alias = awslambda.Alias(
+            self,
+            "TelemetryLambdaAlias",
+            alias_name="CANARY",
+            version=telemetry_version,
+        )
+        ssm.StringParameter(
+            self,
+            "TelemetryFunctionArnParameter",
+            parameter_name="/iot-gg-cicd-workshop/telemetry/function_arn",
+            string_value="{}:{}".format(telemetry_lambda.function_arn, telemetry_version.version),
+            )
+        ssm.StringParameter(
+            self,
+            "TelemetryCanaryVersionArnParameter",
+            parameter_name="/iot-gg-cicd-workshop/telemetry/canary_version_arn",
+            string_value=canary_telemetry_alias.function_arn,
+            )
+
 class LambdaAlias(core.Stack):
-    def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
+    def __init__(self, scope: core.Construct, id: str, telemetry: bool = False, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
+        from aws_cdk import aws_lambda as awslambda, aws_ssm as ssm
         function_arn = ssm.StringParameter.value_for_string_parameter(
             self, 
             "/iot-gg-cicd-workshop/function/function_arn"
@@ -74,115 +115,274 @@ class LambdaAlias(core.Stack):
             string_value=prod_lambda_alias.function_arn,
             )       
 
+        # The telemetry function only exists with telemetry aggregation
+        if not telemetry:
+            return
+
+        telemetry_function_arn = ssm.StringParameter.value_for_string_parameter(
+            self,
+            "/iot-gg-cicd-workshop/telemetry/function_arn"
+            )
+
+        telemetry_version = awslambda.Version.from_version_arn(self, "TelemetryVersion", version_arn=telemetry_function_arn)
+
+        prod_telemetry_alias = awslambda.Alias(
+            self,
+            "TelemetryLambdaAlias",
+            alias_name="PROD",
+            version=telemetry_version,
+        )
+        ssm.StringParameter(
+            self,
+            "TelemetryProdVersionArnParameter",
+            parameter_name="/iot-gg-cicd-workshop/telemetry/prod_version_arn",
+            string_value=prod_telemetry_alias.function_arn,
+            )
+
+# CloudFormation accepts at most 500 resources per stack
+STACK_RESOURCE_LIMIT = 500
+# Groups per stack when the number of shards is derived from the fleet size.
+# A full stack holds about 99 groups, the headroom absorbs the uneven spread
+# of the hash.
+SHARD_SIZE = 64
+
+
+def shard_count(groups: int, shard_size: int = SHARD_SIZE) -> int:
+    return max(1, math.ceil(groups / shard_size))
+
+
+def shard_of(group_id: str, shards: int) -> int:
+    # Jump consistent hash (Lamping and Veach) of the crc32 of the group id,
+    # stable across runs and machines unlike hash(). Going from n to n + 1
+    # shards only moves the groups that land on the new shard.
+    key = zlib.crc32(group_id.encode())
+    shard, candidate = -1, 0
+    while candidate < shards:
+        shard = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((shard + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return shard
+
+
+def core_group_definition_stacks(scope: core.Construct, id: str, deployment_parameter_sets: [dict], shards: int = 1, **kwargs) -> [core.Stack]:
+    # Spread the groups over shards stacks that can be deployed in parallel.
+    # The first shard keeps the original stack name, the others are suffixed
+    # with their number. shard_of keeps a group on its shard unless it moves
+    # to a new one, so adding shards moves about 1/shards of the groups and
+    # never renames the stack the remaining groups are in.
+    stacks = [
+        GreengrassCoreGroupDefinitions(scope, '{}-{:02d}'.format(id, shard) if shard else id, [], **kwargs)
+        for shard in range(max(1, shards))
+    ]
+    for deployment_parameter_set in deployment_parameter_sets:
+        stacks[shard_of(deployment_parameter_set['GroupId'], len(stacks))].add_group(deployment_parameter_set)
+    return stacks
+
+
 class GreengrassCoreGroupDefinitions(core.Stack):
-    def __init__(self, scope: core.Construct, id: str, deployment_parameter_sets: [dict], **kwargs) -> None:
+    def __init__(self, scope: core.Construct, id: str, deployment_parameter_sets: [dict], shared_definitions: bool = False, function_variables: dict = None, telemetry: bool = False, telemetry_variables: dict = None, spool_volume: tuple = None, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
-        function_version_arn = core.CfnParameter(self, "lambdaFunctionArn", type="String").value_as_string
+        self.function_version_arn = core.CfnParameter(self, "lambdaFunctionArn", type="String").value_as_string
+        self.function_variables = function_variables or {}
+
+        # The telemetry aggregation function takes the raw telemetry of the
+        # group's device and publishes one summary per window to the cloud.
+        # Its input subscription has the device as source, which a shared
+        # subscription definition cannot have.
+        self.telemetry_function_arn = None
+        self.telemetry_variables = telemetry_variables or {}
+        if telemetry:
+            if shared_definitions:
+                raise ValueError('Telemetry aggregation needs a subscription definition per group, unset SHARED_DEFINITIONS')
+            self.telemetry_function_arn = core.CfnParameter(self, "telemetryFunctionArn", type="String").value_as_string
+
+        # The disk spool of the functions is kept on a local volume of the
+        # core, one resource definition serves every group of the stack
+        self.spool_volume = spool_volume
+        self.resource_def = None
+        if spool_volume:
+            self.resource_def = self.resource_definition('GreengrassResourceDefinition', id)
+
+        # With shared definitions all groups of the stack use one function and
+        # one subscription definition. The function derives its device from
+        # the core's thing name and the subscription matches the update topic
+        # of every device.
+        self.shared_function_def = None
+        self.shared_subscription_def = None
+        if shared_definitions:
+            self.shared_function_def = self.function_definition('GreengrassFunctionDefinition', id, {})
+            self.shared_subscription_def = self.subscription_definition('GreengrassSubscriptionDefinition', '+/update')
 
         for deployment_parameter_set in deployment_parameter_sets:
-             
-            group_id = deployment_parameter_set['GroupId']
-            group_name = deployment_parameter_set['GroupName']
-            thing_arn = deployment_parameter_set['ThingArn']
-            cert_arn = deployment_parameter_set['CertificateArn']
-            device_arn = str(thing_arn).replace("gg-core", "gg-device")
-            device_name = device_arn.split('/')[-1]
-
-            #####################
-            #  Core Definition  #
-            #####################
-            greengrass_core_def = greengrass.CfnCoreDefinition(self, 'GreengrassCoreDefinition-{}'.format(group_name),
-                name=group_name,
-                initial_version={
-                    'cores': [{
-                        'id': '1',
-                        'certificateArn': cert_arn,
-                        'thingArn': thing_arn,
-                        'syncShadow': True
-                }]
-                }
-            )
+            self.add_group(deployment_parameter_set)
 
-            #######################
-            #  Device Definition  #
-            #######################
-            greengrass_device_def = greengrass.CfnDeviceDefinition(self, 'GreengrassDeviceDefinition-{}'.format(group_name),
-                name=group_name,
-                initial_version={
-                    'devices': [{
-                        'id': '1',
-                        'certificateArn': cert_arn,
-                        'thingArn': device_arn,
-                        'syncShadow': True
-                }]
+    def function_definition(self, construct_id: str, name: str, variables: dict) -> greengrass.CfnFunctionDefinition:
+        ################################
+        #  Lambda Function Definition  #
+        ################################
+        functions = [self.function(1, self.function_version_arn, dict(self.function_variables, **variables))]
+        if self.telemetry_function_arn:
+            functions.append(self.function(2, self.telemetry_function_arn, dict(self.telemetry_variables, **variables)))
+        return greengrass.CfnFunctionDefinition(self, construct_id,
+            name="GreengrassFunction-{}".format(name),
+            initial_version={
+                'defaultConfig': {
+                    'execution': {
+                        'isolationMode': "GreengrassContainer"
+                    }
+                },
+                'functions': functions
+            }
+        )
+
+    def function(self, function_id: int, function_arn: str, variables: dict) -> dict:
+        environment = {
+            'variables': variables,
+            'execution': {
+                'isolationMode': 'GreengrassContainer',
+                'runAs': {
+                    'uid': 1,
+                    'gid': 10
                 }
-            )
+            }
+        }
+        if self.spool_volume:
+            environment['resourceAccessPolicies'] = [{'resourceId': SPOOL_RESOURCE_ID, 'permission': 'rw'}]
+        return {
+            'id': str(function_id),
+            'functionArn': function_arn,
+            'functionConfiguration': {
+                'encodingYype': 'binary',
+                'pinned': True,
+                'executable': 'index.py',
+                'memorySize': 65536,
+                'timeout': 300,
+                'environment': environment
+            }
+        }
 
-            ################################
-            #  Lambda Function Definition  #
-            ################################
-            greengrass_function_def = greengrass.CfnFunctionDefinition(self, 'GreengrassFunctionDefinition-{}'.format(group_name),
-                name="GreengrassFunction-{}".format(group_name),
-                initial_version={
-                    'defaultConfig': {
-                        'execution': {
-                            'isolationMode': "GreengrassContainer"
-                        }
-                    },
-                    'functions': [{
-                        'id': '1',
-                        'functionArn': function_version_arn,
-                        'functionConfiguration': {
-                            'encodingYype': 'binary',
-                            'pinned': True,
-                            'executable': 'index.py',
-                            'memorySize': 65536,
-                            'timeout': 300,
-                            'environment': {
-                                'variables': {
-                                    'CORE_NAME': group_name,
-                                    'DEVICE_NAME': device_name
-                                },
-                                'execution': {
-                                    'isolationMode': 'GreengrassContainer',
-                                    'runAs': {
-                                        'uid': 1,
-                                        'gid': 10
-                                    }
-                                }
+    def resource_definition(self, construct_id: str, name: str) -> greengrass.CfnResourceDefinition:
+        ###########################
+        #  Resource Definition    #
+        ###########################
+        source_path, destination_path = self.spool_volume
+        return greengrass.CfnResourceDefinition(self, construct_id,
+            name="GreengrassResource-{}".format(name),
+            initial_version={
+                'resources': [{
+                    'id': SPOOL_RESOURCE_ID,
+                    'name': 'spool',
+                    'resourceDataContainer': {
+                        'localVolumeResourceData': {
+                            'sourcePath': source_path,
+                            'destinationPath': destination_path,
+                            'groupOwnerSetting': {
+                                'autoAddGroupOwner': True
                             }
                         }
-                    }]
-                }    
-            )
-            ############################
-            #  Subscription Definition #
-            ############################
-            greengrass_subscription_def = greengrass.CfnSubscriptionDefinition(self, 'GreengrassSubscriptionDefinition-{}'.format(group_name), 
-                name='GreengrassSubscription',
-                initial_version={
-                    'subscriptions': [
-                        {
-                            'id': '1',
-                            'source': 'cloud',
-                            'subject': '{}/update'.format(device_name),
-                            'target': function_version_arn
-                        },
-                        # {
-                        #     'id': '2',
-                        #     'source': function_version_arn,
-                        #     'subject': '{}/telemetry'.format(device_name),
-                        #     'target': 'cloud',
-                        # }
-                    ]
-                }
-            )
+                    }
+                }]
+            }
+        )
+
+    def subscription_definition(self, construct_id: str, subject: str, device_arn: str = None, device_name: str = None) -> greengrass.CfnSubscriptionDefinition:
+        ############################
+        #  Subscription Definition #
+        ############################
+        subscriptions = [
+            {
+                'id': '1',
+                'source': 'cloud',
+                'subject': subject,
+                'target': self.function_version_arn
+            },
+        ]
+        if self.telemetry_function_arn and device_arn:
+            subscriptions += [
+                {
+                    'id': '2',
+                    'source': device_arn,
+                    'subject': '{}/telemetry/raw'.format(device_name),
+                    'target': self.telemetry_function_arn,
+                },
+                {
+                    'id': '3',
+                    'source': self.telemetry_function_arn,
+                    'subject': '{}/telemetry'.format(device_name),
+                    'target': 'cloud',
+                },
+            ]
+        return greengrass.CfnSubscriptionDefinition(self, construct_id,
+            name='GreengrassSubscription',
+            initial_version={
+                'subscriptions': subscriptions
+            }
+        )
+
+    def add_group(self, deployment_parameter_set: dict) -> None:
+        group_id = deployment_parameter_set['GroupId']
+        group_name = deployment_parameter_set['GroupName']
+        thing_arn = deployment_parameter_set['ThingArn']
+        cert_arn = deployment_parameter_set['CertificateArn']
+        device_arn = str(thing_arn).replace("gg-core", "gg-device")
+        device_name = device_arn.split('/')[-1]
+
+        #####################
+        #  Core Definition  #
+        #####################
+        greengrass_core_def = greengrass.CfnCoreDefinition(self, 'GreengrassCoreDefinition-{}'.format(group_name),
+            name=group_name,
+            initial_version={
+                'cores': [{
+                    'id': '1',
+                    'certificateArn': cert_arn,
+                    'thingArn': thing_arn,
+                    'syncShadow': True
+            }]
+            }
+        )
+
+        #######################
+        #  Device Definition  #
+        #######################
+        greengrass_device_def = greengrass.CfnDeviceDefinition(self, 'GreengrassDeviceDefinition-{}'.format(group_name),
+            name=group_name,
+            initial_version={
+                'devices': [{
+                    'id': '1',
+                    'certificateArn': cert_arn,
+                    'thingArn': device_arn,
+                    'syncShadow': True
+            }]
+            }
+        )
+
+        greengrass_function_def = self.shared_function_def or self.function_definition(
+            'GreengrassFunctionDefinition-{}'.format(group_name),
+            group_name,
+            {
+                'CORE_NAME': group_name,
+                'DEVICE_NAME': device_name
+            },
+        )
+        greengrass_subscription_def = self.shared_subscription_def or self.subscription_definition(
+            'GreengrassSubscriptionDefinition-{}'.format(group_name),
+            '{}/update'.format(device_name),
+            device_arn,
+            device_name,
+        )
+
+        greengrass_group_version = greengrass.CfnGroupVersion(self, 'GreengrassGroupVersion-{}'.format(group_name),
+            group_id=group_id,
+            core_definition_version_arn=greengrass_core_def.attr_latest_version_arn,
+            function_definition_version_arn=greengrass_function_def.attr_latest_version_arn,
+            subscription_definition_version_arn=greengrass_subscription_def.attr_latest_version_arn,
+            device_definition_version_arn=greengrass_device_def.attr_latest_version_arn,
+            resource_definition_version_arn=self.resource_def.attr_latest_version_arn if self.resource_def else None
+        )
 
-            greengrass_group_version = greengrass.CfnGroupVersion(self, 'GreengrassGroupVersion-{}'.format(group_name),
-                group_id=group_id,
-                core_definition_version_arn=greengrass_core_def.attr_latest_version_arn,
-                function_definition_version_arn=greengrass_function_def.attr_latest_version_arn,
-                subscription_definition_version_arn=greengrass_subscription_def.attr_latest_version_arn,
-                device_definition_version_arn=greengrass_device_def.attr_latest_version_arn
-            )
\ No newline at end of file
+        resources = sum(1 for child in self.node.children if not isinstance(child, core.CfnParameter))
+        if resources > STACK_RESOURCE_LIMIT:
+            raise ValueError('{} exceeds {} resources at group {}, lower CORE_GROUP_SHARD_SIZE or raise CORE_GROUP_SHARDS'.format(
+                self.stack_name, STACK_RESOURCE_LIMIT, group_name))
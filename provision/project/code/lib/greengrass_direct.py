@@ -0,0 +1,327 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Creates the core, device, function, subscription and, with SPOOL_WRITES, the
+# resource definition versions and the group version of every group in GROUP_CONFIG_FILE through the Greengrass
+# API instead of the core group definition stacks, and writes the new group
+# versions to PARAMETER_FILE for deploy.py. The Lambda function and alias
+# stay with CloudFormation.
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_clients import RegionalClients
+from function_arns import FunctionArns, arn_region
+from function_settings import SPOOL_RESOURCE_ID, function_variables, spool_volume, telemetry_variables
+from group_hash import DEFINITION_HASH_TAG, definition_hash
+from manifest import read_manifest, write_manifest
+
+GROUP_CONFIG_FILE = os.environ.get('GROUP_CONFIG_FILE','gg_group_config.json')
+PARAMETER_FILE = os.environ.get('PARAMETER_FILE','deploy_params.json')
+DIRECT_WORKERS = int(os.environ.get('DIRECT_WORKERS','16'))
+SHARED_DEFINITIONS = os.environ.get('SHARED_DEFINITIONS','false').lower() == 'true'
+TELEMETRY_FUNCTION_ARN = os.environ.get('TELEMETRY_FUNCTION_ARN','')
+TELEMETRY_FUNCTION_PARAMETER = os.environ.get('TELEMETRY_FUNCTION_PARAMETER','')
+
+
+def client_token(*parts):
+    # Idempotency key of a create call, a retried call with the same inputs
+    # returns the version created the first time
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:64]
+
+
+def definition_id(definition_version_arn):
+    # arn:aws:greengrass:<region>:<account>:/greengrass/definition/<kind>/<id>/versions/<version>
+    return definition_version_arn.split('/')[-3] if definition_version_arn else None
+
+
+def create_definition_version(gg_client, kind, current_id, name, content, token_parts):
+    # A new version of the definition the group already uses, or a new
+    # definition when the group has none of this kind
+    token = client_token(kind, name, content, *token_parts)
+    if current_id:
+        response = getattr(gg_client, 'create_{}_definition_version'.format(kind))(
+            AmznClientToken=token,
+            **dict(content, **{'{}DefinitionId'.format(kind.capitalize()): current_id})
+            )
+        return response['Arn']
+    response = getattr(gg_client, 'create_{}_definition'.format(kind))(
+        AmznClientToken=token,
+        Name=name,
+        InitialVersion=content,
+        )
+    return response['LatestVersionArn']
+
+
+def function(function_id, function_arn, variables):
+    environment = {
+        'Variables': variables,
+        'Execution': {
+            'IsolationMode': 'GreengrassContainer',
+            'RunAs': {
+                'Uid': 1,
+                'Gid': 10
+            }
+        }
+    }
+    if spool_volume():
+        environment['ResourceAccessPolicies'] = [{'ResourceId': SPOOL_RESOURCE_ID, 'Permission': 'rw'}]
+    return {
+        'Id': str(function_id),
+        'FunctionArn': function_arn,
+        'FunctionConfiguration': {
+            'EncodingType': 'json',
+            'Pinned': True,
+            'Executable': 'index.py',
+            'MemorySize': 65536,
+            'Timeout': 300,
+            'Environment': environment
+        }
+    }
+
+
+def function_definition(function_arn, variables, telemetry_function_arn=None):
+    # Same function configuration as the core group definition stacks. Their
+    # encoding key is misspelled and ignored, so they run with the default
+    # json encoding the handlers expect.
+    functions = [function(1, function_arn, dict(function_variables(), **variables))]
+    if telemetry_function_arn:
+        functions.append(function(2, telemetry_function_arn, dict(telemetry_variables(), **variables)))
+    return {
+        'DefaultConfig': {
+            'Execution': {
+                'IsolationMode': 'GreengrassContainer'
+            }
+        },
+        'Functions': functions
+    }
+
+
+def subscription_definition(function_arn, subject, telemetry_function_arn=None, device_arn=None, device_name=None):
+    subscriptions = [{
+        'Id': '1',
+        'Source': 'cloud',
+        'Subject': subject,
+        'Target': function_arn
+    }]
+    if telemetry_function_arn and device_arn:
+        subscriptions += [{
+            'Id': '2',
+            'Source': device_arn,
+            'Subject': '{}/telemetry/raw'.format(device_name),
+            'Target': telemetry_function_arn
+        }, {
+            'Id': '3',
+            'Source': telemetry_function_arn,
+            'Subject': '{}/telemetry'.format(device_name),
+            'Target': 'cloud'
+        }]
+    return {
+        'Subscriptions': subscriptions
+    }
+
+
+def resource_definition(volume):
+    # The local volume the functions keep their disk spool on
+    source_path, destination_path = volume
+    return {
+        'Resources': [{
+            'Id': SPOOL_RESOURCE_ID,
+            'Name': 'spool',
+            'ResourceDataContainer': {
+                'LocalVolumeResourceData': {
+                    'SourcePath': source_path,
+                    'DestinationPath': destination_path,
+                    'GroupOwnerSetting': {
+                        'AutoAddGroupOwner': True
+                    }
+                }
+            }
+        }]
+    }
+
+
+def find_definition(gg_client, kind, name):
+    for page in gg_client.get_paginator('list_{}_definitions'.format(kind)).paginate():
+        for definition in page['Definitions']:
+            if definition.get('Name') == name:
+                return definition['Id']
+    return None
+
+
+class SharedDefinitions:
+    # One function, subscription and resource definition version per fleet
+    # and region, created on first use and referenced by every group
+    def __init__(self, gg_clients, fleet, function_arns):
+        self.gg_clients = gg_clients
+        self.fleet = fleet
+        self.function_arns = function_arns
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, region):
+        with self.lock:
+            if region not in self.versions:
+                gg_client = self.gg_clients.get(region)
+                name = 'GreengrassFunction-{}'.format(self.fleet)
+                function_arn = self.function_arns.get(region)
+                function_content = function_definition(function_arn, {})
+                subscription_content = subscription_definition(function_arn, '+/update')
+                volume = spool_volume()
+                self.versions[region] = (
+                    create_definition_version(gg_client, 'function', find_definition(gg_client, 'function', name),
+                        name, function_content, [region]),
+                    create_definition_version(gg_client, 'subscription', find_definition(gg_client, 'subscription', name),
+                        name, subscription_content, [region]),
+                    create_definition_version(gg_client, 'resource', find_definition(gg_client, 'resource', name),
+                        name, resource_definition(volume), [region]) if volume else None,
+                )
+            return self.versions[region]
+
+
+def create_group_version(gg_client, deployment_parameter_set, function_arn, shared=None, telemetry_function_arn=None):
+    # Returns the parameter set with the new GroupVersionId, groups whose
+    # definition hash tag matches their inputs keep their version
+    group_id = deployment_parameter_set['GroupId']
+    group_name = deployment_parameter_set['GroupName']
+    content_hash = definition_hash(deployment_parameter_set, function_arn, shared is not None, function_variables(),
+        telemetry_function_arn, telemetry_variables())
+    if deployment_parameter_set.get('DefinitionHash') == content_hash and deployment_parameter_set.get('GroupVersionId'):
+        return deployment_parameter_set, False
+
+    current = {}
+    if deployment_parameter_set.get('GroupVersionId'):
+        current = gg_client.get_group_version(
+            GroupId=group_id,
+            GroupVersionId=deployment_parameter_set['GroupVersionId'],
+            )['Definition']
+    thing_arn = deployment_parameter_set['ThingArn']
+    cert_arn = deployment_parameter_set['CertificateArn']
+    device_arn = str(thing_arn).replace("gg-core", "gg-device")
+    device_name = device_arn.split('/')[-1]
+    token_parts = [group_id, content_hash]
+
+    core_version_arn = create_definition_version(gg_client, 'core',
+        definition_id(current.get('CoreDefinitionVersionArn')), group_name,
+        {'Cores': [{'Id': '1', 'CertificateArn': cert_arn, 'ThingArn': thing_arn, 'SyncShadow': True}]},
+        token_parts)
+    device_version_arn = create_definition_version(gg_client, 'device',
+        definition_id(current.get('DeviceDefinitionVersionArn')), group_name,
+        {'Devices': [{'Id': '1', 'CertificateArn': cert_arn, 'ThingArn': device_arn, 'SyncShadow': True}]},
+        token_parts)
+    if shared:
+        function_version_arn, subscription_version_arn, resource_version_arn = shared.get(deployment_parameter_set.get('Region'))
+    else:
+        function_version_arn = create_definition_version(gg_client, 'function',
+            definition_id(current.get('FunctionDefinitionVersionArn')), 'GreengrassFunction-{}'.format(group_name),
+            function_definition(function_arn, {'CORE_NAME': group_name, 'DEVICE_NAME': device_name}, telemetry_function_arn),
+            token_parts)
+        subscription_version_arn = create_definition_version(gg_client, 'subscription',
+            definition_id(current.get('SubscriptionDefinitionVersionArn')), 'GreengrassSubscription',
+            subscription_definition(function_arn, '{}/update'.format(device_name),
+                telemetry_function_arn, device_arn, device_name),
+            token_parts)
+        volume = spool_volume()
+        resource_version_arn = create_definition_version(gg_client, 'resource',
+            definition_id(current.get('ResourceDefinitionVersionArn')), 'GreengrassResource-{}'.format(group_name),
+            resource_definition(volume), token_parts) if volume else None
+
+    definition_versions = dict(
+        CoreDefinitionVersionArn=core_version_arn,
+        DeviceDefinitionVersionArn=device_version_arn,
+        FunctionDefinitionVersionArn=function_version_arn,
+        SubscriptionDefinitionVersionArn=subscription_version_arn,
+        )
+    if resource_version_arn:
+        definition_versions['ResourceDefinitionVersionArn'] = resource_version_arn
+    group_version = gg_client.create_group_version(
+        AmznClientToken=client_token('group', token_parts),
+        GroupId=group_id,
+        **definition_versions
+        )
+    gg_client.tag_resource(
+        ResourceArn=group_version['Arn'].split('/versions/')[0],
+        tags={DEFINITION_HASH_TAG: content_hash},
+        )
+    return dict(deployment_parameter_set, GroupVersionId=group_version['Version'], DefinitionHash=content_hash), True
+
+
+def check_region(deployment_parameter_set, *function_arns):
+    # The groups can only run a Lambda of their own region
+    region = deployment_parameter_set.get('Region')
+    for function_arn in filter(None, function_arns):
+        if region and region != arn_region(function_arn):
+            raise ValueError('Group {} is in {} but its function {} is not'.format(
+                deployment_parameter_set['GroupId'], region, function_arn))
+
+
+def create_group_versions(gg_clients, deployment_parameter_sets, function_arns, shared=None, counts=None, telemetry_function_arns=None):
+    # Creates the group versions on a bounded pool and yields the parameter
+    # sets in manifest order, holding only a window of groups in memory.
+    # Every group runs the functions of its own region.
+    counts = counts if counts is not None else collections.Counter()
+    window = max(1, DIRECT_WORKERS) * 4
+
+    def apply(deployment_parameter_set, function_arn, telemetry_function_arn):
+        return create_group_version(gg_clients.get(deployment_parameter_set.get('Region')),
+            deployment_parameter_set, function_arn, shared, telemetry_function_arn)
+
+    with ThreadPoolExecutor(max_workers=max(1, DIRECT_WORKERS)) as executor:
+        futures = collections.deque()
+
+        def result():
+            deployment_parameter_set, created = futures.popleft().result()
+            counts['created' if created else 'unchanged'] += 1
+            return deployment_parameter_set
+
+        for deployment_parameter_set in deployment_parameter_sets:
+            region = deployment_parameter_set.get('Region')
+            function_arn = function_arns.get(region)
+            telemetry_function_arn = telemetry_function_arns.get(region) if telemetry_function_arns else None
+            check_region(deployment_parameter_set, function_arn, telemetry_function_arn)
+            futures.append(executor.submit(apply, deployment_parameter_set, function_arn, telemetry_function_arn))
+            if len(futures) >= window:
+                yield result()
+        while futures:
+            yield result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the group versions of a fleet through the Greengrass API")
+    parser.add_argument('fleet', help="fleet the groups in {} belong to".format(GROUP_CONFIG_FILE))
+    parser.add_argument('--function-arn', nargs='+', default=[],
+        help="Lambda alias or version ARNs the groups run, at most one per region")
+    parser.add_argument('--function-parameter',
+        help="SSM parameter holding the function ARN in each region without a --function-arn")
+    parser.add_argument('--shared-definitions', action='store_true', default=SHARED_DEFINITIONS)
+    parser.add_argument('--telemetry-function-arn', nargs='+', default=list(filter(None, TELEMETRY_FUNCTION_ARN.split(','))),
+        help="Lambda alias or version ARNs of the telemetry aggregation function, if the groups run it")
+    parser.add_argument('--telemetry-function-parameter', default=TELEMETRY_FUNCTION_PARAMETER or None,
+        help="SSM parameter holding the telemetry function ARN in each region without a --telemetry-function-arn")
+    args = parser.parse_args()
+
+    ssm_clients = RegionalClients('ssm')
+    function_arns = FunctionArns(args.function_arn, args.function_parameter, ssm_clients)
+    telemetry_function_arns = FunctionArns(args.telemetry_function_arn, args.telemetry_function_parameter, ssm_clients)
+    if not function_arns:
+        parser.error('one of --function-arn or --function-parameter is required')
+    if args.shared_definitions and telemetry_function_arns:
+        parser.error('telemetry aggregation needs a subscription definition per group')
+
+    gg_clients = RegionalClients('greengrass', max_concurrency=DIRECT_WORKERS)
+    shared = SharedDefinitions(gg_clients, args.fleet, function_arns) if args.shared_definitions else None
+    counts = collections.Counter()
+    write_manifest(PARAMETER_FILE,
+        create_group_versions(gg_clients, read_manifest(GROUP_CONFIG_FILE), function_arns, shared, counts,
+            telemetry_function_arns or None),
+        Fleet=args.fleet)
+    print('Created {} group versions, {} groups unchanged'.format(counts['created'], counts['unchanged']))
+
+
+if __name__ == '__main__':
+    main()
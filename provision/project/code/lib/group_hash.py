@@ -0,0 +1,64 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import hashlib
+import json
+
+# Tag on the Greengrass group holding the hash of the last successful
+# deployment, discovery reads it together with the fleet tag
+DEPLOYED_HASH_TAG = 'deployed-hash'
+# Tag holding the hash of the definitions greengrass_direct.py last created
+DEFINITION_HASH_TAG = 'definition-hash'
+# Bump when the inputs below change meaning, so every group is deployed once
+HASH_VERSION = 1
+# Bump when greengrass_direct.py generates different definitions from the
+# same inputs, so every group gets a new group version once. Version 2
+# switched the functions from binary to json encoding, version 3 added the
+# spool volume resource.
+DEFINITION_HASH_VERSION = 3
+
+
+def group_hash(deployment_parameter_set, function_version_arn, telemetry_version_arn=None):
+    # The effective definition of a group: the group version the CDK stacks
+    # produced, the core it runs on and the Lambda versions it pins
+    content = {
+        'HashVersion': HASH_VERSION,
+        'GroupId': deployment_parameter_set['GroupId'],
+        'GroupVersionId': deployment_parameter_set.get('GroupVersionId'),
+        'ThingArn': deployment_parameter_set.get('ThingArn'),
+        'CertificateArn': deployment_parameter_set.get('CertificateArn'),
+        'FunctionVersionArn': function_version_arn,
+    }
+    # Only present with telemetry aggregation, the hashes of groups without
+    # it stay the same
+    if telemetry_version_arn:
+        content['TelemetryVersionArn'] = telemetry_version_arn
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def definition_hash(deployment_parameter_set, function_arn, shared_definitions=False, function_variables=None, telemetry_function_arn=None, telemetry_variables=None):
+    # The inputs the definitions of a group are generated from
+    content = {
+        'HashVersion': DEFINITION_HASH_VERSION,
+        'GroupId': deployment_parameter_set['GroupId'],
+        'GroupName': deployment_parameter_set.get('GroupName'),
+        'ThingArn': deployment_parameter_set.get('ThingArn'),
+        'CertificateArn': deployment_parameter_set.get('CertificateArn'),
+        'FunctionArn': function_arn,
+        'SharedDefinitions': shared_definitions,
+        'FunctionVariables': function_variables or {},
+    }
+    if telemetry_function_arn:
+        content['TelemetryFunctionArn'] = telemetry_function_arn
+        content['TelemetryVariables'] = telemetry_variables or {}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def resolve_function_version(lambda_client, function_arn):
+    # Alias ARNs are resolved to the version they point at, a new Lambda
+    # version behind the same alias changes every group hash
+    arn_parts = function_arn.split(':')
+    if len(arn_parts) < 8 or arn_parts[7].isdigit():
+        return function_arn
+    alias = lambda_client.get_alias(FunctionName=':'.join(arn_parts[:7]), Name=arn_parts[7])
+    return '{}:{}'.format(':'.join(arn_parts[:7]), alias['FunctionVersion'])
@@ -0,0 +1,57 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import os
+from datetime import datetime
+
+# Deployment target manifests (gg_group_config.json, deploy_params.json) are
+# written as newline delimited JSON: a header record followed by one
+# deployment parameter set per line. Readers also accept the original
+# single JSON array files.
+MANIFEST = 'greengrass-deployment-targets'
+MANIFEST_VERSION = 1
+MANIFEST_FORMAT = os.environ.get('MANIFEST_FORMAT','ndjson')
+
+
+def write_manifest(path, deployment_parameter_sets, manifest_format=MANIFEST_FORMAT, **header):
+    # Writes the entries as they are produced, to a temporary file that
+    # replaces the manifest once complete. Returns the number of entries.
+    count = 0
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, "w") as manifest_file:
+        if manifest_format == 'json':
+            manifest_file.write('[')
+            for deployment_parameter_set in deployment_parameter_sets:
+                manifest_file.write('{}{}'.format(', ' if count else '', json.dumps(deployment_parameter_set)))
+                count += 1
+            manifest_file.write(']')
+        else:
+            header = dict(header, Manifest=MANIFEST, Version=MANIFEST_VERSION, Created=datetime.utcnow().isoformat())
+            manifest_file.write('{}\n'.format(json.dumps(header)))
+            for deployment_parameter_set in deployment_parameter_sets:
+                manifest_file.write('{}\n'.format(json.dumps(deployment_parameter_set)))
+                count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_manifest(path):
+    # Yields the deployment parameter sets of a manifest one by one
+    with open(path, "r") as manifest_file:
+        first = manifest_file.read(1)
+        while first.isspace():
+            first = manifest_file.read(1)
+        if first == '[':
+            manifest_file.seek(0)
+            for deployment_parameter_set in json.load(manifest_file):
+                yield deployment_parameter_set
+            return
+        manifest_file.seek(0)
+        for line in manifest_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'Manifest' in record:
+                continue
+            yield record
@@ -1,17 +1,87 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: MIT-0
 
+import atexit
 import os
 import json
+import signal
+import sys
 import greengrasssdk
 from datetime import datetime
 
+from reported_state import ReportedStateCache
+from shadow_coalescer import ShadowCoalescer
+from spool import store_and_forward
+
 client = greengrasssdk.client('iot-data')
 
+# Groups with their own function definition pass DEVICE_NAME, with a shared
+# definition the device is derived from the thing name of the core
+DEVICE_NAME = os.environ.get('DEVICE_NAME') or os.environ.get('AWS_IOT_THING_NAME', '').replace('gg-core', 'gg-device')
+# Buffer bursts of updates and write the latest merged state per device once
+# per window, or as soon as COALESCE_MAX_PENDING updates are buffered
+COALESCE_UPDATES = os.environ.get('COALESCE_UPDATES', 'false').lower() == 'true'
+COALESCE_WINDOW_MS = float(os.environ.get('COALESCE_WINDOW_MS', '200'))
+COALESCE_MAX_PENDING = int(os.environ.get('COALESCE_MAX_PENDING', '100'))
+# Skip writes that only change the timestamp, an unchanged state is still
+# written once every SUPPRESS_MAX_AGE_S seconds
+SUPPRESS_UNCHANGED = os.environ.get('SUPPRESS_UNCHANGED', 'false').lower() == 'true'
+SUPPRESS_MAX_AGE_S = float(os.environ.get('SUPPRESS_MAX_AGE_S', '300'))
+
+
+def get_shadow(thing_name):
+    return client.get_thing_shadow(thingName=thing_name)['payload']
+
+
+def write_shadow(record):
+    client.update_thing_shadow(
+        thingName=record['thing'],
+        payload=json.dumps({"state":{"reported": record['reported']}})
+    )
+
+
+state_cache = ReportedStateCache(get_shadow, SUPPRESS_MAX_AGE_S) if SUPPRESS_UNCHANGED else None
+
+# Shadow writes go through a disk spool while the link is down, see spool.py
+spool = store_and_forward(write_shadow, 'device_shadow')
+if spool:
+    atexit.register(spool.stop)
+
+
+def update_shadow(thing_name, reported):
+    if state_cache and not state_cache.changed(thing_name, reported):
+        return
+    record = {'thing': thing_name, 'reported': reported}
+    if spool:
+        spool.write(record)
+    else:
+        write_shadow(record)
+    if state_cache:
+        state_cache.record(thing_name, reported)
+
+
+coalescer = None
+if COALESCE_UPDATES:
+    coalescer = ShadowCoalescer(update_shadow, COALESCE_WINDOW_MS / 1000, COALESCE_MAX_PENDING).start()
+    # Buffered updates are written before the pinned function stops, and
+    # before the spool is closed
+    atexit.register(coalescer.stop)
+if coalescer or spool:
+    if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        try:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        except ValueError:
+            pass
+
 def handler(event, context):
     '''Update shadow'''   
-    message = {"state":{"reported":{"param": event['message'], "timestamp": str(datetime.now())}}}
-    client.update_thing_shadow(
-        thingName=os.environ['DEVICE_NAME'],
-        payload=json.dumps(message)
-    )
\ No newline at end of file
+    # A shared subscription delivers the update topic of every device
+    client_context = getattr(context, 'client_context', None)
+    subject = client_context.custom.get('subject', '') if client_context and client_context.custom else ''
+    if subject and subject.split('/')[0] != DEVICE_NAME:
+        return
+    reported = {"param": event['message'], "timestamp": str(datetime.now())}
+    if coalescer:
+        coalescer.put(DEVICE_NAME, reported)
+    else:
+        update_shadow(DEVICE_NAME, reported)
@@ -0,0 +1,64 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Reported fields that change with every message without changing the state
+VOLATILE_FIELDS = ('timestamp',)
+
+
+class ReportedStateCache:
+    # Last reported state per thing, seeded from the shadow on first use.
+    # A write that changes nothing but the volatile fields is suppressed,
+    # unless the last write of the thing is older than max_age seconds.
+    def __init__(self, get_shadow, max_age=300, log_every=1000):
+        self.get_shadow = get_shadow
+        self.max_age = max_age
+        self.log_every = log_every
+        self.states = {}
+        self.written_at = {}
+        self.suppressed = 0
+        self.forwarded = 0
+        self.lock = threading.Lock()
+
+    def _seed(self, thing_name):
+        try:
+            shadow = json.loads(self.get_shadow(thing_name))
+            return shadow.get('state', {}).get('reported', {})
+        except Exception:
+            logger.info('No reported state for {}, the next write is forwarded'.format(thing_name))
+            return {}
+
+    def changed(self, thing_name, reported):
+        with self.lock:
+            seeded = thing_name in self.states
+        if not seeded:
+            state = self._seed(thing_name)
+            with self.lock:
+                self.states.setdefault(thing_name, state)
+        with self.lock:
+            state = self.states[thing_name]
+            unchanged = all(state.get(key) == value for key, value in reported.items() if key not in VOLATILE_FIELDS)
+            fresh = time.monotonic() - self.written_at.get(thing_name, float('-inf')) < self.max_age
+            if unchanged and (fresh or thing_name not in self.written_at):
+                # A seeded state counts as written now, so the rate limit
+                # also applies to the first unchanged writes after a restart
+                self.written_at.setdefault(thing_name, time.monotonic())
+                self.suppressed += 1
+                changed = False
+            else:
+                self.forwarded += 1
+                changed = True
+            if (self.suppressed + self.forwarded) % self.log_every == 0:
+                logger.info('Shadow writes forwarded {} suppressed {}'.format(self.forwarded, self.suppressed))
+        return changed
+
+    def record(self, thing_name, reported):
+        with self.lock:
+            self.states[thing_name] = dict(self.states.get(thing_name, {}), **reported)
+            self.written_at[thing_name] = time.monotonic()
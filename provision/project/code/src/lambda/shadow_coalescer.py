@@ -0,0 +1,67 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowCoalescer:
+    # Buffers reported states per thing and writes only the latest merged
+    # state of each thing, once per window or as soon as max_pending updates
+    # are buffered. Writes happen on a background thread, stop() flushes
+    # whatever is still buffered.
+    def __init__(self, publish, window=0.2, max_pending=100):
+        self.publish = publish
+        self.window = window
+        self.max_pending = max_pending
+        self.pending = {}
+        self.buffered = 0
+        self.received = 0
+        self.written = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.wake.set()
+        self.thread.join()
+
+    def put(self, thing_name, reported):
+        with self.lock:
+            self.pending.setdefault(thing_name, {}).update(reported)
+            self.buffered += 1
+            self.received += 1
+            full = self.buffered >= self.max_pending
+        if full:
+            self.wake.set()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.buffered = 0
+        for thing_name, reported in pending.items():
+            try:
+                self.publish(thing_name, reported)
+                self.written += 1
+            except Exception:
+                logger.exception('Shadow update of {} failed, retrying with the next flush'.format(thing_name))
+                with self.lock:
+                    # Updates that arrived in the meantime win
+                    self.pending[thing_name] = dict(reported, **self.pending.get(thing_name, {}))
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.window)
+            self.wake.clear()
+            self.flush()
+        self.flush()
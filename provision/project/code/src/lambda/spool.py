@@ -0,0 +1,305 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Keep writes in a disk spool while the upstream call fails or is slower
+# than SPOOL_SLOW_MS, and replay them in order once it recovers. Each
+# function spools to its own directory below SPOOL_DIR.
+SPOOL_WRITES = os.environ.get('SPOOL_WRITES', 'false').lower() == 'true'
+SPOOL_DIR = os.environ.get('SPOOL_DIR', '/tmp/spool')
+SPOOL_MAX_BYTES = int(os.environ.get('SPOOL_MAX_BYTES', '10485760'))
+SPOOL_SEGMENT_BYTES = int(os.environ.get('SPOOL_SEGMENT_BYTES', '1048576'))
+SPOOL_SYNC_EVERY = int(os.environ.get('SPOOL_SYNC_EVERY', '32'))
+SPOOL_SLOW_MS = float(os.environ.get('SPOOL_SLOW_MS', '1000'))
+SPOOL_DRAIN_BATCH = int(os.environ.get('SPOOL_DRAIN_BATCH', '100'))
+SPOOL_DRAIN_INTERVAL_S = float(os.environ.get('SPOOL_DRAIN_INTERVAL_S', '5'))
+# A spooled record that failed this many drains in a row is moved to the
+# dead letter file of the spool once the record behind it can be sent, 0
+# retries it forever
+SPOOL_MAX_ATTEMPTS = int(os.environ.get('SPOOL_MAX_ATTEMPTS', '100'))
+
+
+class DiskSpool:
+    # Append-only JSON lines spread over numbered segment files. Appends are
+    # fsynced every sync_every records, a cursor file records how far the
+    # spool has been drained. Once the segments exceed max_bytes the oldest
+    # segments are deleted, drained or not.
+    def __init__(self, directory, max_bytes=10485760, segment_bytes=1048576, sync_every=32):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.sync_every = sync_every
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith('.seg'))
+        self.sizes = dict((segment, os.path.getsize(self._path(segment))) for segment in self.segments)
+        self.cursor = self._load_cursor()
+        self.writer = None
+        self.unsynced = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, '{:010d}.seg'.format(segment))
+
+    def _load_cursor(self):
+        if not self.segments:
+            return 0, 0
+        first = self.segments[0]
+        try:
+            with open(os.path.join(self.directory, 'cursor')) as f:
+                segment, offset = json.load(f)
+        except (OSError, ValueError):
+            return first, 0
+        return (segment, offset) if segment >= first else (first, 0)
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, 'cursor')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.cursor, f)
+        os.replace(path + '.tmp', path)
+
+    def _sync(self):
+        if self.writer and self.unsynced:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            self.unsynced = 0
+
+    def _rotate(self):
+        # Segments left by an earlier run are never appended to, their last
+        # line may be torn
+        if self.writer:
+            self._sync()
+            self.writer.close()
+        segment = self.segments[-1] + 1 if self.segments else self.cursor[0]
+        self.segments.append(segment)
+        self.sizes[segment] = 0
+        self.writer = open(self._path(segment), 'ab')
+
+    def _evict(self):
+        total = sum(self.sizes.values())
+        while total > self.max_bytes and len(self.segments) > 1:
+            segment = self.segments.pop(0)
+            size = self.sizes.pop(segment)
+            total -= size
+            if self.cursor[0] <= segment:
+                self.evicted += size - (self.cursor[1] if self.cursor[0] == segment else 0)
+                self.cursor = (self.segments[0], 0)
+            os.remove(self._path(segment))
+            logger.warning('Spool exceeds {} bytes, evicted segment {}'.format(self.max_bytes, segment))
+
+    def append(self, record):
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self.lock:
+            if self.writer is None or 0 < self.sizes[self.segments[-1]] and self.sizes[self.segments[-1]] + len(line) > self.segment_bytes:
+                self._rotate()
+            self.writer.write(line)
+            self.sizes[self.segments[-1]] += len(line)
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                self._sync()
+            self._evict()
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def pending_bytes(self):
+        with self.lock:
+            segment, offset = self.cursor
+            return sum(size - (offset if current == segment else 0)
+                for current, size in self.sizes.items() if current >= segment)
+
+    def empty(self):
+        return self.pending_bytes() <= 0
+
+    def read_batch(self, max_records):
+        # Returns up to max_records (position, record) pairs in append order,
+        # a position is what commit() takes to mark the record as drained.
+        # Unreadable records come back as None so the cursor moves past them.
+        with self.lock:
+            if self.writer:
+                self.writer.flush()
+            segment, offset = self.cursor
+            batch = []
+            for current in self.segments:
+                if current < segment or len(batch) >= max_records:
+                    continue
+                if current > segment:
+                    segment, offset = current, 0
+                with open(self._path(segment), 'rb') as f:
+                    f.seek(offset)
+                    while len(batch) < max_records and offset < self.sizes[segment]:
+                        line = f.readline()
+                        if not line.endswith(b'\n'):
+                            # Torn write of an earlier run
+                            offset = self.sizes[segment]
+                            batch.append(((segment, offset), None))
+                            break
+                        offset += len(line)
+                        try:
+                            batch.append(((segment, offset), json.loads(line)))
+                        except ValueError:
+                            logger.warning('Skipping a corrupt spool record in segment {}'.format(segment))
+                            batch.append(((segment, offset), None))
+            return batch
+
+    def commit(self, position):
+        # Drained segments other than the one being written are deleted
+        with self.lock:
+            # The segment may have been evicted while it was replayed
+            self.cursor = position if position[0] >= self.segments[0] else (self.segments[0], 0)
+            while self.segments[0] < position[0] or self.segments[0] == position[0] and position[1] >= self.sizes[position[0]] and len(self.segments) > 1:
+                segment = self.segments.pop(0)
+                del self.sizes[segment]
+                os.remove(self._path(segment))
+                if segment == position[0]:
+                    self.cursor = (self.segments[0], 0)
+            self._save_cursor()
+
+    def dead_letter(self, record):
+        # Records that cannot be sent are kept for inspection, outside the
+        # segments and the size cap
+        with self.lock:
+            with open(os.path.join(self.directory, 'dead-letter'), 'ab') as f:
+                f.write((json.dumps(record, separators=(',', ':')) + '\n').encode())
+
+    def close(self):
+        with self.lock:
+            if self.writer:
+                self._sync()
+                self.writer.close()
+                self.writer = None
+
+
+class StoreAndForward:
+    # Sends records upstream while the link is healthy. After a failed send,
+    # or one slower than slow_after seconds, records go to the spool until a
+    # background thread has replayed it in order, batch records at a time.
+    # A record whose replay failed max_attempts drains in a row is dead
+    # lettered so it cannot hold back the records behind it, but only once
+    # the next record goes through. While the link is down nothing is dead
+    # lettered.
+    def __init__(self, send, spool, slow_after=1.0, batch=100, interval=5.0, max_attempts=100):
+        self.send = send
+        self.spool = spool
+        self.slow_after = slow_after
+        self.batch = batch
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.spooling = not spool.empty()
+        self.spooled = 0
+        self.replayed = 0
+        self.dead_lettered = 0
+        self.failing = None
+        self.attempts = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.spool.close()
+
+    def _append(self, record):
+        self.spool.append(record)
+        self.spooled += 1
+
+    def write(self, record):
+        with self.lock:
+            if self.spooling:
+                self._append(record)
+                return
+        started = time.monotonic()
+        try:
+            self.send(record)
+        except Exception:
+            logger.exception('Upstream write failed, spooling until the link recovers')
+            with self.lock:
+                self._append(record)
+                self.spooling = True
+            return
+        if time.monotonic() - started > self.slow_after:
+            logger.warning('Upstream write took {:.1f}s, spooling until the link recovers'.format(time.monotonic() - started))
+            with self.lock:
+                self.spooling = True
+
+    def drain(self):
+        # Replays until the spool is empty or a send fails, the cursor is
+        # saved once per batch
+        self.spool.sync()
+        while True:
+            batch = self.spool.read_batch(self.batch)
+            if not batch:
+                with self.lock:
+                    # Appends hold the same lock, nothing is spooled behind
+                    # the records that were just replayed
+                    if self.spool.empty():
+                        self.spooling = False
+                return
+            drained = None
+            try:
+                index = 0
+                while index < len(batch):
+                    index += self._replay(batch, index) if batch[index][1] is not None else 1
+                    drained = batch[index - 1][0]
+            except Exception:
+                logger.info('Upstream still unavailable, {} spooled records replayed so far'.format(self.replayed))
+                return
+            finally:
+                if drained:
+                    self.spool.commit(drained)
+
+    def _replay(self, batch, index):
+        # Sends the record at index and returns the number of records of the
+        # batch that were consumed. Past max_attempts the next record of the
+        # batch is sent as a probe, the failing record is only dead lettered
+        # when the probe goes through.
+        position, record = batch[index]
+        try:
+            self.send(record)
+            self.replayed += 1
+            return 1
+        except Exception:
+            if self.failing != position:
+                self.failing, self.attempts = position, 0
+            self.attempts += 1
+            if not self.max_attempts or self.attempts < self.max_attempts:
+                raise
+            probe = next((probe for probe in range(index + 1, len(batch)) if batch[probe][1] is not None), None)
+            if probe is None:
+                raise
+        self.send(batch[probe][1])
+        self.replayed += 1
+        logger.error('Spooled record failed {} replays while the next one went through, moving it to the dead letter file'.format(self.attempts))
+        self.spool.dead_letter(record)
+        self.dead_lettered += 1
+        return probe - index + 1
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            if self.spooling:
+                self.drain()
+
+
+def store_and_forward(send, name):
+    # A started StoreAndForward spooling to SPOOL_DIR/name, None when
+    # spooling is off
+    if not SPOOL_WRITES:
+        return None
+    spool = DiskSpool(os.path.join(SPOOL_DIR, name), SPOOL_MAX_BYTES, SPOOL_SEGMENT_BYTES, SPOOL_SYNC_EVERY)
+    return StoreAndForward(send, spool, SPOOL_SLOW_MS / 1000, SPOOL_DRAIN_BATCH, SPOOL_DRAIN_INTERVAL_S, SPOOL_MAX_ATTEMPTS).start()
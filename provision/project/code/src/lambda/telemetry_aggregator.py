@@ -0,0 +1,67 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+import greengrasssdk
+
+from spool import store_and_forward
+from telemetry_window import WindowAggregator
+
+logger = logging.getLogger(__name__)
+
+# Summaries cover the last TELEMETRY_WINDOW_S seconds and are published every
+# TELEMETRY_SLIDE_S seconds, equal values give tumbling windows
+TELEMETRY_WINDOW_S = float(os.environ.get('TELEMETRY_WINDOW_S', '60'))
+TELEMETRY_SLIDE_S = float(os.environ.get('TELEMETRY_SLIDE_S', os.environ.get('TELEMETRY_WINDOW_S', '60')))
+TELEMETRY_PERCENTILES = [float(p) for p in os.environ.get('TELEMETRY_PERCENTILES', '50,90,99').split(',') if p]
+TELEMETRY_MAX_SAMPLES = int(os.environ.get('TELEMETRY_MAX_SAMPLES', '10000'))
+
+
+client = greengrasssdk.client('iot-data')
+aggregator = WindowAggregator(TELEMETRY_WINDOW_S, TELEMETRY_SLIDE_S, TELEMETRY_PERCENTILES, TELEMETRY_MAX_SAMPLES)
+
+
+def publish(record):
+    client.publish(topic=record['topic'], payload=record['payload'])
+
+
+# Summaries go through a disk spool while the link is down, see spool.py
+spool = store_and_forward(publish, 'telemetry')
+if spool:
+    atexit.register(spool.stop)
+
+
+def publish_summaries():
+    # Runs for the lifetime of the pinned function
+    next_run = time.monotonic() + TELEMETRY_SLIDE_S
+    while True:
+        time.sleep(max(0, next_run - time.monotonic()))
+        next_run += TELEMETRY_SLIDE_S
+        for device_name, summary in aggregator.summaries():
+            record = {'topic': '{}/telemetry'.format(device_name), 'payload': json.dumps(summary)}
+            try:
+                if spool:
+                    spool.write(record)
+                else:
+                    publish(record)
+            except Exception:
+                logger.exception('Publishing the telemetry summary of {} failed'.format(device_name))
+
+
+threading.Thread(target=publish_summaries, daemon=True).start()
+
+
+def handler(event, context):
+    '''Aggregate raw telemetry'''
+    # Raw samples arrive on <device>/telemetry/raw
+    client_context = getattr(context, 'client_context', None)
+    subject = client_context.custom.get('subject', '') if client_context and client_context.custom else ''
+    device_name = subject.split('/')[0] or os.environ.get('DEVICE_NAME')
+    if device_name and isinstance(event, dict):
+        aggregator.add(device_name, event)
@@ -0,0 +1,83 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import math
+import threading
+import time
+from collections import deque
+
+
+def percentile(ordered, p):
+    # Linear interpolation between the closest ranks of a sorted list
+    rank = (len(ordered) - 1) * p / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values, percentiles):
+    # All statistics of a field come from one sort of the window
+    ordered = sorted(values)
+    summary = {
+        'count': len(ordered),
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': math.fsum(ordered) / len(ordered),
+    }
+    for p in percentiles:
+        summary['p{:g}'.format(p)] = percentile(ordered, p)
+    return summary
+
+
+class WindowAggregator:
+    # Numeric payload fields per device over a window sliding every slide
+    # seconds. Samples are kept per field in arrival order and evicted once
+    # they fall out of the window. Past max_samples the oldest samples are
+    # dropped, each summary reports how many were dropped since the last one.
+    def __init__(self, window=60, slide=60, percentiles=(50, 90, 99), max_samples=10000):
+        self.window = window
+        self.slide = slide
+        self.percentiles = percentiles
+        self.max_samples = max_samples
+        self.fields = {}
+        self.dropped = {}
+        self.lock = threading.Lock()
+
+    def add(self, device_name, payload, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            fields = self.fields.setdefault(device_name, {})
+            for name, value in payload.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    samples = fields.setdefault(name, deque(maxlen=self.max_samples))
+                    if len(samples) == self.max_samples and samples[0][0] > now - self.window:
+                        dropped = self.dropped.setdefault(device_name, {})
+                        dropped[name] = dropped.get(name, 0) + 1
+                    samples.append((now, value))
+
+    def summaries(self, now=None):
+        # Yields (device, summary) for every device with samples in the window
+        now = time.monotonic() if now is None else now
+        start = now - self.window
+        with self.lock:
+            windows = {}
+            dropped, self.dropped = self.dropped, {}
+            for device_name, fields in list(self.fields.items()):
+                for name, samples in list(fields.items()):
+                    while samples and samples[0][0] <= start:
+                        samples.popleft()
+                    if samples:
+                        windows.setdefault(device_name, {})[name] = [value for _, value in samples]
+                    else:
+                        del fields[name]
+                if not fields:
+                    del self.fields[device_name]
+        for device_name, fields in windows.items():
+            summaries = {}
+            for name, values in fields.items():
+                summaries[name] = summarize(values, self.percentiles)
+                summaries[name]['dropped'] = dropped.get(device_name, {}).get(name, 0)
+            yield device_name, {
+                'window': self.window,
+                'fields': summaries,
+            }
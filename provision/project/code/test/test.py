@@ -2,6 +2,8 @@
 ## SPDX-License-Identifier: MIT-0
 
 import json
+import os
+import sys
 import time
 import unittest
 import uuid
@@ -10,6 +12,9 @@ import logging
 import boto3
 from botocore.exceptions import ClientError
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from manifest import read_manifest
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
@@ -26,9 +31,8 @@ class TestShadowUpdateFunction(unittest.TestCase):
     def setUp(self):
         PARAMETER_FILE = '../deploy_params.json'
         try:
-            with open(PARAMETER_FILE, "r+") as json_file:
-                deployment_parameter_sets = json.load(json_file)
-                self.device_name = deployment_parameter_sets[0]['ThingArn'].split('/')[-1].replace('gg-core', 'gg-device')
+            deployment_parameter_set = next(read_manifest(PARAMETER_FILE))
+            self.device_name = deployment_parameter_set['ThingArn'].split('/')[-1].replace('gg-core', 'gg-device')
         except:
             self.device_name = None
         
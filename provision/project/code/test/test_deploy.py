@@ -0,0 +1,225 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import deploy
+from deploy_events import DeploymentEventTracker, LocalEventSource, deployment_status_change
+
+
+def deployment_parameter_sets(groups):
+    return [{'GroupId': 'group-{}'.format(i), 'GroupVersionId': 'v1'} for i in range(groups)]
+
+
+class Greengrass:
+    # Deployments of the failing groups fail, every other one succeeds
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.deployed = []
+        self.reset = []
+
+    def get_group(self, GroupId):
+        return {'LatestVersion': 'v1'}
+
+    def create_deployment(self, DeploymentType, GroupId, GroupVersionId):
+        self.deployed.append(GroupId)
+        return {'DeploymentId': 'deployment-{}'.format(GroupId)}
+
+    def get_deployment_status(self, GroupId, DeploymentId):
+        if GroupId in self.failing:
+            return {'DeploymentStatus': 'Failure', 'ErrorMessage': 'Simulated failure', 'ErrorDetails': []}
+        return {'DeploymentStatus': 'Success'}
+
+    def reset_deployments(self, GroupId, Force=False):
+        self.reset.append(GroupId)
+
+
+class ScriptedGreengrass:
+    # Answers the status polls of a group with its script of statuses, the
+    # last one repeats
+    def __init__(self, scripts):
+        self.scripts = scripts
+        self.polls = dict((group_id, 0) for group_id in scripts)
+
+    def get_deployment_status(self, GroupId, DeploymentId):
+        script = self.scripts[GroupId]
+        status = script[min(self.polls[GroupId], len(script) - 1)]
+        self.polls[GroupId] += 1
+        if status == 'Failure':
+            return {'DeploymentStatus': status, 'ErrorMessage': 'Simulated failure', 'ErrorDetails': []}
+        return {'DeploymentStatus': status}
+
+
+def deployments_of(gg_client):
+    return dict((group_id, {'DeploymentId': 'deployment-{}'.format(group_id)}) for group_id in gg_client.scripts)
+
+
+class TestSplitWaves(unittest.TestCase):
+
+    def sizes(self, groups, wave_size):
+        return [len(wave) for wave in deploy.split_waves(deployment_parameter_sets(groups), wave_size)]
+
+    def test_fixed_size(self):
+        self.assertEqual(self.sizes(10, '4'), [4, 4, 2])
+        self.assertEqual(self.sizes(10, '0'), [1] * 10)
+
+    def test_fixed_size_reads_the_manifest_lazily(self):
+        waves = deploy.split_waves(iter(deployment_parameter_sets(10)), '4')
+        self.assertEqual([p['GroupId'] for p in next(waves)], ['group-0', 'group-1', 'group-2', 'group-3'])
+
+    def test_percentage(self):
+        self.assertEqual(self.sizes(10, '25%'), [3, 3, 3, 1])
+        self.assertEqual(self.sizes(10, '100%'), [10])
+        self.assertEqual(self.sizes(3, '1%'), [1, 1, 1])
+
+    def test_single_wave(self):
+        self.assertEqual(self.sizes(10, ''), [10])
+        self.assertEqual(self.sizes(0, ''), [0])
+        self.assertEqual(self.sizes(0, '4'), [])
+        self.assertEqual(self.sizes(0, '10%'), [])
+
+
+@mock.patch.object(deploy, 'POLL_INITIAL_DELAY', 0.01)
+@mock.patch.object(deploy, 'WAVE_SIZE', '4')
+@mock.patch.object(deploy, 'FAILURE_THRESHOLD', 0.25)
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_aborts_once_the_threshold_is_crossed(self):
+        # 2 of the 4 groups of the first wave fail
+        gg_client = Greengrass(failing=('group-0', 'group-1'))
+        failed = deploy.rollout(gg_client, deployment_parameter_sets(12), regions=None)
+        self.assertEqual(failed[-1], 'ABORTED')
+        self.assertEqual(len(failed), 3)
+        self.assertEqual(gg_client.deployed, ['group-{}'.format(i) for i in range(4)])
+        self.assertEqual(gg_client.reset, [])
+
+    def test_failures_at_the_threshold_continue(self):
+        # 1 of 4 is not above the threshold, 2 of 8 neither
+        gg_client = Greengrass(failing=('group-0', 'group-5'))
+        failed = deploy.rollout(gg_client, deployment_parameter_sets(12), regions=None)
+        self.assertNotIn('ABORTED', failed)
+        self.assertEqual(len(failed), 2)
+        self.assertEqual(len(gg_client.deployed), 12)
+
+    def test_clean_waves_deploy_the_fleet(self):
+        gg_client = Greengrass()
+        self.assertEqual(deploy.rollout(gg_client, deployment_parameter_sets(10), regions=None), [])
+        self.assertEqual(len(gg_client.deployed), 10)
+
+    def test_failing_last_wave_is_not_aborted(self):
+        gg_client = Greengrass(failing=('group-8', 'group-9'))
+        failed = deploy.rollout(gg_client, deployment_parameter_sets(10), regions=None)
+        self.assertNotIn('ABORTED', failed)
+        self.assertEqual(len(failed), 2)
+
+    @mock.patch.object(deploy, 'RESET_ON_FAILURE', True)
+    def test_abort_resets_the_failed_groups(self):
+        gg_client = Greengrass(failing=('group-0', 'group-1'))
+        deploy.rollout(gg_client, deployment_parameter_sets(12), regions=None)
+        self.assertEqual(sorted(gg_client.reset), ['group-0', 'group-1'])
+
+
+@mock.patch.object(deploy, 'POLL_INITIAL_DELAY', 0.01)
+@mock.patch.object(deploy, 'POLL_MAX_DELAY', 0.02)
+class TestPolling(unittest.TestCase):
+
+    def test_in_progress_is_polled_again(self):
+        gg_client = ScriptedGreengrass({
+            'group-0': ['InProgress', 'InProgress', 'Success'],
+            'group-1': ['Building', 'Failure'],
+            'group-2': ['Success'],
+        })
+        failed, pending = deploy.wait_for_deployments(gg_client, deployments_of(gg_client), time.monotonic() + 10)
+        self.assertEqual(failed, [{'group-1': {'ErrorMessage': 'Simulated failure', 'ErrorDetails': []}}])
+        self.assertEqual(pending, {})
+        self.assertEqual(gg_client.polls, {'group-0': 3, 'group-1': 2, 'group-2': 1})
+
+    def test_deadline_returns_the_pending_deployments(self):
+        gg_client = ScriptedGreengrass({'group-0': ['InProgress'], 'group-1': ['Success']})
+        started = time.monotonic()
+        failed, pending = deploy.wait_for_deployments(gg_client, deployments_of(gg_client), started + 0.2)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(failed, [])
+        self.assertEqual(list(pending), ['group-0'])
+        self.assertGreater(gg_client.polls['group-0'], 1)
+
+    @mock.patch.object(deploy, 'DEPLOY_TIMEOUT', 0.2)
+    def test_rollout_times_out(self):
+        gg_client = Greengrass()
+        gg_client.get_deployment_status = lambda GroupId, DeploymentId: {'DeploymentStatus': 'InProgress'}
+        self.assertEqual(deploy.rollout(gg_client, deployment_parameter_sets(2), regions=None), ['TIMEOUT'])
+
+
+class TestEventTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.source = LocalEventSource()
+        self.tracker = DeploymentEventTracker(self.source, wait_seconds=0.01).start()
+
+    def tearDown(self):
+        self.tracker.stop()
+
+    def test_statuses_of_tracked_deployments(self):
+        self.tracker.track({'group-0': {'DeploymentId': 'deployment-group-0'}})
+        self.source.put({'detail-type': 'Other', 'detail': {'deployment-id': 'deployment-group-0', 'status': 'Failure'}})
+        self.source.put(deployment_status_change('group-1', 'deployment-group-1', 'InProgress'))
+        self.source.put(deployment_status_change('group-0', 'deployment-group-0', 'Success'))
+        self.assertEqual(self.tracker.statuses.get(timeout=1), ('group-0', 'Success'))
+        self.assertTrue(self.tracker.statuses.empty())
+
+    def test_terminal_event_before_track(self):
+        self.source.put(deployment_status_change('group-0', 'deployment-group-0', 'Success'))
+        while not self.tracker.early:
+            time.sleep(0.01)
+        self.tracker.track({'group-0': {'DeploymentId': 'deployment-group-0'}})
+        self.assertEqual(self.tracker.statuses.get(timeout=1), ('group-0', 'Success'))
+
+
+@mock.patch.object(deploy, 'POLL_INITIAL_DELAY', 0.01)
+@mock.patch.object(deploy, 'POLL_MAX_DELAY', 0.02)
+class TestEventMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.source = LocalEventSource()
+        self.tracker = DeploymentEventTracker(self.source, wait_seconds=0.01).start()
+
+    def tearDown(self):
+        self.tracker.stop()
+
+    @mock.patch.object(deploy, 'EVENT_GRACE', 10)
+    def test_success_event_ends_polling(self):
+        gg_client = ScriptedGreengrass({'group-0': ['InProgress'], 'group-1': ['InProgress']})
+        for group_id in gg_client.scripts:
+            self.source.put(deployment_status_change(group_id, 'deployment-{}'.format(group_id), 'Success'))
+        started = time.monotonic()
+        failed, pending = deploy.wait_for_deployments(gg_client, deployments_of(gg_client), started + 5, self.tracker)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual((failed, pending), ([], {}))
+        self.assertEqual(gg_client.polls, {'group-0': 0, 'group-1': 0})
+
+    @mock.patch.object(deploy, 'EVENT_GRACE', 10)
+    def test_failure_event_polls_for_the_details(self):
+        gg_client = ScriptedGreengrass({'group-0': ['Failure'], 'group-1': ['InProgress']})
+        self.source.put(deployment_status_change('group-0', 'deployment-group-0', 'Failure'))
+        self.source.put(deployment_status_change('group-1', 'deployment-group-1', 'Success'))
+        failed, pending = deploy.wait_for_deployments(gg_client, deployments_of(gg_client), time.monotonic() + 5, self.tracker)
+        self.assertEqual(failed, [{'group-0': {'ErrorMessage': 'Simulated failure', 'ErrorDetails': []}}])
+        self.assertEqual(pending, {})
+        self.assertEqual(gg_client.polls, {'group-0': 1, 'group-1': 0})
+
+    @mock.patch.object(deploy, 'EVENT_GRACE', 0.05)
+    def test_groups_without_events_are_polled_after_the_grace(self):
+        gg_client = ScriptedGreengrass({'group-0': ['InProgress', 'Success'], 'group-1': ['InProgress']})
+        self.source.put(deployment_status_change('group-1', 'deployment-group-1', 'Success'))
+        failed, pending = deploy.wait_for_deployments(gg_client, deployments_of(gg_client), time.monotonic() + 5, self.tracker)
+        self.assertEqual((failed, pending), ([], {}))
+        self.assertEqual(gg_client.polls, {'group-0': 2, 'group-1': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+import deploy
+import deployment_targets
+from deploy_checkpoint import Checkpoint
+from fake_aws import FakeAws
+from group_hash import DEPLOYED_HASH_TAG, group_hash
+
+OLD_FUNCTION = 'arn:aws:lambda:us-east-1:123456789012:function:iot-gg-cicd-workshop-function:1'
+NEW_FUNCTION = 'arn:aws:lambda:us-east-1:123456789012:function:iot-gg-cicd-workshop-function:2'
+
+
+class FailingGreengrass:
+    # Creates deployments for every group but failing_group
+    def __init__(self, failing_group):
+        self.failing_group = failing_group
+
+    def create_deployment(self, GroupId, **kwargs):
+        if GroupId == self.failing_group:
+            raise RuntimeError('CreateDeployment failed')
+        return {
+            'DeploymentId': 'deployment-{}'.format(GroupId),
+            'DeploymentArn': 'arn:aws:greengrass:us-east-1:123456789012:/greengrass/groups/{}/deployments/1'.format(GroupId),
+        }
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'checkpoint.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resume_rules(self):
+        checkpoint = Checkpoint(self.path)
+        checkpoint.record('done', DeploymentId='d1', GroupVersionId='v1', Status='Success')
+        checkpoint.record('running', DeploymentId='d2', GroupVersionId='v1', Status='InProgress')
+        checkpoint.record('failed', DeploymentId='d3', GroupVersionId='v1', Status='Failure')
+        checkpoint.flush()
+        checkpoint = Checkpoint(self.path).load()
+
+        self.assertEqual(checkpoint.resume_state({'GroupId': 'done', 'GroupVersionId': 'v1'}), 'done')
+        self.assertEqual(checkpoint.resume_state({'GroupId': 'running', 'GroupVersionId': 'v1'})['DeploymentId'], 'd2')
+        self.assertIsNone(checkpoint.resume_state({'GroupId': 'failed', 'GroupVersionId': 'v1'}))
+        self.assertIsNone(checkpoint.resume_state({'GroupId': 'unknown', 'GroupVersionId': 'v1'}))
+        # A new group version is deployed again
+        self.assertIsNone(checkpoint.resume_state({'GroupId': 'done', 'GroupVersionId': 'v2'}))
+
+    def test_resume_requires_the_group_hash(self):
+        checkpoint = Checkpoint(self.path)
+        checkpoint.record('done', DeploymentId='d1', GroupVersionId='v1', Status='Success', GroupHash='h1')
+        checkpoint.record('running', DeploymentId='d2', GroupVersionId='v1', Status='InProgress', GroupHash='h1')
+        checkpoint.record('legacy', DeploymentId='d3', GroupVersionId='v1', Status='Success')
+
+        self.assertEqual(checkpoint.resume_state({'GroupId': 'done', 'GroupVersionId': 'v1'}, 'h1'), 'done')
+        self.assertEqual(checkpoint.resume_state({'GroupId': 'running', 'GroupVersionId': 'v1'}, 'h1')['DeploymentId'], 'd2')
+        # Same group version, new function version behind the alias
+        self.assertIsNone(checkpoint.resume_state({'GroupId': 'done', 'GroupVersionId': 'v1'}, 'h2'))
+        self.assertIsNone(checkpoint.resume_state({'GroupId': 'running', 'GroupVersionId': 'v1'}, 'h2'))
+        self.assertIsNone(checkpoint.resume_state({'GroupId': 'legacy', 'GroupVersionId': 'v1'}, 'h1'))
+
+    def test_load_without_checkpoint(self):
+        self.assertEqual(Checkpoint(self.path).load().groups, {})
+
+    def test_created_deployments_survive_a_failed_create(self):
+        deployment_parameter_sets = [{'GroupId': 'group-{}'.format(i), 'GroupVersionId': 'v1'} for i in range(10)]
+        checkpoint = Checkpoint(self.path)
+        with self.assertRaises(RuntimeError):
+            deploy.create_deployments(FailingGreengrass('group-5'), deployment_parameter_sets, workers=4, checkpoint=checkpoint)
+        checkpoint.flush()
+
+        checkpoint = Checkpoint(self.path).load()
+        for deployment_parameter_set in deployment_parameter_sets:
+            state = checkpoint.resume_state(deployment_parameter_set)
+            if deployment_parameter_set['GroupId'] == 'group-5':
+                self.assertIsNone(state)
+            else:
+                self.assertEqual(state['DeploymentId'], 'deployment-{}'.format(deployment_parameter_set['GroupId']))
+
+
+    @mock.patch.object(deploy, 'POLL_INITIAL_DELAY', 0.01)
+    def test_stale_checkpoint_is_deployed_again(self):
+        aws = FakeAws(deploy_seconds=0).add_fleet(3, 'main')
+        gg_client = aws.client('greengrass')
+        deployment_parameter_sets = list(deployment_targets.discover(aws.client('resourcegroupstaggingapi'), gg_client, 'main'))
+        # Left over from the rollout of the previous function version, the
+        # group versions of the stacks did not change since
+        checkpoint = Checkpoint(self.path)
+        for deployment_parameter_set in deployment_parameter_sets:
+            checkpoint.record(deployment_parameter_set['GroupId'], DeploymentId='old', Status='Success',
+                GroupVersionId=deployment_parameter_set['GroupVersionId'],
+                GroupHash=group_hash(deployment_parameter_set, OLD_FUNCTION))
+
+        failed = deploy.rollout(gg_client, deployment_parameter_sets, checkpoint=checkpoint, resume=True,
+            function_version_arn=NEW_FUNCTION, regions=None)
+        self.assertEqual(failed, [])
+        self.assertEqual(aws.calls['CreateDeployment'], len(deployment_parameter_sets))
+        for deployment_parameter_set in deployment_parameter_sets:
+            self.assertEqual(aws.groups[deployment_parameter_set['GroupId']]['tags'][DEPLOYED_HASH_TAG],
+                group_hash(deployment_parameter_set, NEW_FUNCTION))
+
+        # Resuming the rollout that just completed deploys nothing again
+        deploy.rollout(gg_client, deployment_parameter_sets, checkpoint=checkpoint, resume=True,
+            function_version_arn=NEW_FUNCTION, regions=None)
+        self.assertEqual(aws.calls['CreateDeployment'], len(deployment_parameter_sets))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from deploy_metrics import METRIC_DATA_BATCH, METRIC_DATA_VALUES, DeploymentMetrics
+
+
+class CloudWatch:
+    # Records the PutMetricData calls
+    def __init__(self):
+        self.calls = []
+
+    def put_metric_data(self, Namespace, MetricData):
+        self.calls.append((Namespace, MetricData))
+
+
+def completed_metrics(groups, seconds):
+    metrics = DeploymentMetrics()
+    for i in range(groups):
+        group_id = 'group-{}'.format(i)
+        metrics.created(group_id, 0, 0.5)
+        metrics.status(group_id, 'InProgress', at=1)
+        metrics.status(group_id, 'Success', at=seconds(i))
+    return metrics
+
+
+class TestDeploymentMetrics(unittest.TestCase):
+
+    def test_values_are_sent_with_their_counts(self):
+        metrics = completed_metrics(4, lambda i: 10 if i < 3 else 20)
+        cloudwatch = CloudWatch()
+        self.assertEqual(metrics.put_metrics(cloudwatch, 'namespace', 'canary'), 3)
+
+        namespace, metric_data = cloudwatch.calls[0]
+        self.assertEqual(namespace, 'namespace')
+        metric_data = dict((datum['MetricName'], datum) for datum in metric_data)
+        self.assertEqual(metric_data['CreateSeconds']['Values'], [0.5])
+        self.assertEqual(metric_data['CreateSeconds']['Counts'], [4])
+        self.assertEqual(metric_data['CompletedSeconds']['Values'], [10, 20])
+        self.assertEqual(metric_data['CompletedSeconds']['Counts'], [3, 1])
+        self.assertEqual(metric_data['CompletedSeconds']['Dimensions'], [{'Name': 'Fleet', 'Value': 'canary'}])
+        self.assertEqual(metric_data['CompletedSeconds']['Unit'], 'Seconds')
+
+    def test_calls_stay_within_the_limits(self):
+        metrics = completed_metrics(METRIC_DATA_VALUES * METRIC_DATA_BATCH, lambda i: 2 + i)
+        cloudwatch = CloudWatch()
+        sent = metrics.put_metrics(cloudwatch, 'namespace', 'main')
+        self.assertEqual(sent, 2 + METRIC_DATA_BATCH)
+        self.assertEqual(len(cloudwatch.calls), 2)
+        for _, metric_data in cloudwatch.calls:
+            self.assertLessEqual(len(metric_data), METRIC_DATA_BATCH)
+            for datum in metric_data:
+                self.assertLessEqual(len(datum['Values']), METRIC_DATA_VALUES)
+        completed = sum(sum(datum['Counts']) for _, metric_data in cloudwatch.calls
+            for datum in metric_data if datum['MetricName'] == 'CompletedSeconds')
+        self.assertEqual(completed, METRIC_DATA_VALUES * METRIC_DATA_BATCH)
+
+    def test_nothing_to_send(self):
+        cloudwatch = CloudWatch()
+        self.assertEqual(DeploymentMetrics().put_metrics(cloudwatch, 'namespace', 'main'), 0)
+        self.assertEqual(cloudwatch.calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
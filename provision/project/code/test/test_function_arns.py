@@ -0,0 +1,73 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from function_arns import FunctionArns
+
+US_EAST_1 = 'arn:aws:lambda:us-east-1:123456789012:function:iot-gg-cicd-workshop-function:CANARY'
+
+
+class Ssm:
+    # Stand-in for the SSM client of region, the parameter holds the
+    # function of that region
+    def __init__(self, region):
+        self.region = region
+        self.calls = 0
+
+    def get_parameter(self, Name, WithDecryption=False):
+        self.calls += 1
+        return {'Parameter': {'Value': 'arn:aws:lambda:{}:123456789012:function:iot-gg-cicd-workshop-function:CANARY'.format(
+            self.region or 'us-west-2')}}
+
+
+class SsmClients:
+    def __init__(self):
+        self.clients = {}
+
+    def get(self, region=None):
+        return self.clients.setdefault(region, Ssm(region))
+
+
+class TestFunctionArns(unittest.TestCase):
+
+    def test_given_arns_are_keyed_by_region(self):
+        function_arns = FunctionArns([US_EAST_1])
+        self.assertEqual(function_arns.get('us-east-1'), US_EAST_1)
+        self.assertEqual(function_arns.get(None), US_EAST_1)
+        with self.assertRaises(ValueError):
+            function_arns.get('eu-west-1')
+
+    def test_other_regions_read_the_parameter_once(self):
+        ssm_clients = SsmClients()
+        function_arns = FunctionArns([US_EAST_1], '/iot-gg-cicd-workshop/function/canary_version_arn', ssm_clients)
+        self.assertEqual(function_arns.get('us-east-1'), US_EAST_1)
+        self.assertEqual(function_arns.get('eu-west-1').split(':')[3], 'eu-west-1')
+        function_arns.get('eu-west-1')
+        self.assertEqual(ssm_clients.clients['eu-west-1'].calls, 1)
+        self.assertNotIn('us-east-1', ssm_clients.clients)
+        # Groups without a region use the parameter of the default region
+        self.assertEqual(function_arns.get(None).split(':')[3], 'us-west-2')
+
+    def test_resolve_is_applied_once_per_region(self):
+        resolved = []
+
+        def resolve(function_arn):
+            resolved.append(function_arn)
+            return function_arn.replace('CANARY', '7')
+
+        function_arns = FunctionArns([US_EAST_1], resolve=resolve)
+        self.assertEqual(function_arns.get('us-east-1'), US_EAST_1.replace('CANARY', '7'))
+        function_arns.get('us-east-1')
+        self.assertEqual(resolved, [US_EAST_1])
+
+    def test_empty(self):
+        self.assertFalse(FunctionArns([]))
+        self.assertTrue(FunctionArns([], '/parameter'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from manifest import MANIFEST, read_manifest, write_manifest
+
+SETS = [{'GroupId': 'group-{}'.format(i), 'GroupName': 'core-{}'.format(i)} for i in range(5)]
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'manifest.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ndjson_round_trip(self):
+        count = write_manifest(self.path, iter(SETS), 'ndjson', Fleet='canary')
+        self.assertEqual(count, len(SETS))
+        self.assertEqual(list(read_manifest(self.path)), SETS)
+        with open(self.path) as manifest_file:
+            header = json.loads(manifest_file.readline())
+        self.assertEqual(header['Manifest'], MANIFEST)
+        self.assertEqual(header['Fleet'], 'canary')
+
+    def test_json_round_trip(self):
+        self.assertEqual(write_manifest(self.path, SETS, 'json'), len(SETS))
+        with open(self.path) as manifest_file:
+            self.assertEqual(json.load(manifest_file), SETS)
+        self.assertEqual(list(read_manifest(self.path)), SETS)
+
+    def test_reads_legacy_array_with_leading_whitespace(self):
+        with open(self.path, 'w') as manifest_file:
+            manifest_file.write('\n  ' + json.dumps(SETS))
+        self.assertEqual(list(read_manifest(self.path)), SETS)
+
+    def test_skips_blank_lines(self):
+        write_manifest(self.path, SETS, 'ndjson')
+        with open(self.path, 'a') as manifest_file:
+            manifest_file.write('\n\n')
+        self.assertEqual(list(read_manifest(self.path)), SETS)
+
+    def test_empty_manifest(self):
+        self.assertEqual(write_manifest(self.path, [], 'ndjson'), 0)
+        self.assertEqual(list(read_manifest(self.path)), [])
+
+    def test_failed_write_keeps_previous_manifest(self):
+        write_manifest(self.path, SETS, 'ndjson')
+
+        def failing():
+            yield SETS[0]
+            raise RuntimeError('discovery failed')
+
+        with self.assertRaises(RuntimeError):
+            write_manifest(self.path, failing(), 'ndjson')
+        self.assertEqual(list(read_manifest(self.path)), SETS)
+
+
+if __name__ == '__main__':
+    unittest.main()
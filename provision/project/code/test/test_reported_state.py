@@ -0,0 +1,67 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lambda'))
+from reported_state import ReportedStateCache
+
+
+class Shadows:
+    # Stand-in for get_thing_shadow, unknown things have no shadow
+    def __init__(self, reported=None):
+        self.reported = reported or {}
+        self.calls = 0
+
+    def __call__(self, thing_name):
+        self.calls += 1
+        if thing_name not in self.reported:
+            raise Exception('ResourceNotFoundException')
+        return json.dumps({'state': {'reported': self.reported[thing_name]}})
+
+
+class TestReportedStateCache(unittest.TestCase):
+
+    def test_first_write_without_shadow_is_forwarded(self):
+        cache = ReportedStateCache(Shadows())
+        self.assertTrue(cache.changed('thing-1', {'message': 1}))
+
+    def test_seeded_state_suppresses_unchanged_write(self):
+        shadows = Shadows({'thing-1': {'message': 1, 'timestamp': 'a'}})
+        cache = ReportedStateCache(shadows)
+        self.assertFalse(cache.changed('thing-1', {'message': 1, 'timestamp': 'b'}))
+        self.assertFalse(cache.changed('thing-1', {'message': 1, 'timestamp': 'c'}))
+        self.assertTrue(cache.changed('thing-1', {'message': 2, 'timestamp': 'd'}))
+        self.assertEqual(shadows.calls, 1)
+        self.assertEqual((cache.suppressed, cache.forwarded), (2, 1))
+
+    def test_recorded_state_suppresses_repeats(self):
+        cache = ReportedStateCache(Shadows())
+        self.assertTrue(cache.changed('thing-1', {'message': 1}))
+        cache.record('thing-1', {'message': 1})
+        self.assertFalse(cache.changed('thing-1', {'message': 1}))
+        self.assertTrue(cache.changed('thing-1', {'message': 2}))
+
+    def test_record_merges_fields(self):
+        cache = ReportedStateCache(Shadows())
+        cache.record('thing-1', {'a': 1})
+        cache.record('thing-1', {'b': 2})
+        self.assertFalse(cache.changed('thing-1', {'a': 1, 'b': 2}))
+
+    def test_unchanged_write_is_forwarded_after_max_age(self):
+        cache = ReportedStateCache(Shadows({'thing-1': {'message': 1}}), max_age=0)
+        # The seeded state counts as written now
+        self.assertFalse(cache.changed('thing-1', {'message': 1}))
+        self.assertTrue(cache.changed('thing-1', {'message': 1}))
+
+    def test_things_are_cached_separately(self):
+        cache = ReportedStateCache(Shadows())
+        cache.record('thing-1', {'message': 1})
+        self.assertTrue(cache.changed('thing-2', {'message': 1}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lambda'))
+from shadow_coalescer import ShadowCoalescer
+
+
+class Publisher:
+    # Records the writes, failing the first failures of them
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.writes = []
+        self.written = threading.Event()
+
+    def __call__(self, thing_name, reported):
+        if self.failures:
+            self.failures -= 1
+            raise Exception('Simulated failure')
+        self.writes.append((thing_name, reported))
+        self.written.set()
+
+
+class TestShadowCoalescer(unittest.TestCase):
+
+    def test_merges_updates_per_thing(self):
+        publisher = Publisher()
+        coalescer = ShadowCoalescer(publisher)
+        coalescer.put('thing-1', {'a': 1, 'b': 1})
+        coalescer.put('thing-1', {'a': 2})
+        coalescer.put('thing-2', {'a': 3})
+        coalescer.flush()
+        self.assertEqual(sorted(publisher.writes), [('thing-1', {'a': 2, 'b': 1}), ('thing-2', {'a': 3})])
+        self.assertEqual((coalescer.received, coalescer.written), (3, 2))
+
+    def test_flush_without_updates_writes_nothing(self):
+        publisher = Publisher()
+        ShadowCoalescer(publisher).flush()
+        self.assertEqual(publisher.writes, [])
+
+    def test_failed_write_is_retried_under_newer_updates(self):
+        publisher = Publisher(failures=1)
+        coalescer = ShadowCoalescer(publisher)
+        coalescer.put('thing-1', {'a': 1, 'b': 1})
+        coalescer.flush()
+        self.assertEqual(publisher.writes, [])
+        coalescer.put('thing-1', {'a': 2})
+        coalescer.flush()
+        self.assertEqual(publisher.writes, [('thing-1', {'a': 2, 'b': 1})])
+
+    def test_max_pending_flushes_before_the_window(self):
+        publisher = Publisher()
+        coalescer = ShadowCoalescer(publisher, window=60, max_pending=2).start()
+        try:
+            coalescer.put('thing-1', {'a': 1})
+            coalescer.put('thing-1', {'a': 2})
+            self.assertTrue(publisher.written.wait(5))
+            self.assertEqual(publisher.writes, [('thing-1', {'a': 2})])
+        finally:
+            coalescer.stop()
+
+    def test_stop_flushes_buffered_updates(self):
+        publisher = Publisher()
+        coalescer = ShadowCoalescer(publisher, window=60).start()
+        coalescer.put('thing-1', {'a': 1})
+        coalescer.stop()
+        self.assertEqual(publisher.writes, [('thing-1', {'a': 1})])
+        coalescer.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
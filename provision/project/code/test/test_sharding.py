@@ -0,0 +1,83 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import collections
+import os
+import sys
+import unittest
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    from aws_cdk import core
+    from lib.greengrass import GreengrassCoreGroupDefinitions, STACK_RESOURCE_LIMIT, core_group_definition_stacks, shard_count, shard_of
+except ImportError:
+    core = None
+
+
+def deployment_parameter_sets(groups):
+    return [{
+        'GroupId': str(uuid.uuid4()),
+        'GroupName': 'gg-group-{}'.format(i),
+        'ThingArn': 'arn:aws:iot:us-east-1:123456789012:thing/gg-core-{}'.format(i),
+        'CertificateArn': 'arn:aws:iot:us-east-1:123456789012:cert/{}'.format(i),
+    } for i in range(groups)]
+
+
+@unittest.skipIf(core is None, 'aws_cdk is not installed')
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.group_ids = [str(uuid.uuid4()) for _ in range(5000)]
+
+    def test_shard_count(self):
+        self.assertEqual(shard_count(0, 64), 1)
+        self.assertEqual(shard_count(64, 64), 1)
+        self.assertEqual(shard_count(65, 64), 2)
+
+    def test_assignment_is_stable_and_in_range(self):
+        shards = shard_count(len(self.group_ids))
+        for group_id in self.group_ids:
+            shard = shard_of(group_id, shards)
+            self.assertTrue(0 <= shard < shards)
+            self.assertEqual(shard, shard_of(group_id, shards))
+
+    def test_adding_a_shard_only_moves_groups_to_it(self):
+        shards = shard_count(len(self.group_ids))
+        moved = 0
+        for group_id in self.group_ids:
+            before, after = shard_of(group_id, shards), shard_of(group_id, shards + 1)
+            self.assertIn(after, (before, shards))
+            moved += before != after
+        self.assertLess(moved, 2 * len(self.group_ids) / (shards + 1))
+
+    def test_derived_shards_fit_in_a_stack(self):
+        shards = shard_count(len(self.group_ids))
+        sizes = collections.Counter(shard_of(group_id, shards) for group_id in self.group_ids)
+        self.assertLess(max(sizes.values()), 99)
+
+    def test_growing_keeps_the_first_stack(self):
+        groups = deployment_parameter_sets(60)
+
+        def stacks_of_groups(shards):
+            stacks = core_group_definition_stacks(core.App(), 'fleet', groups, shards)
+            return [stack.stack_name for stack in stacks], dict(
+                (child.node.id.split('-', 1)[1], stack.stack_name) for stack in stacks
+                for child in stack.node.children if child.node.id.startswith('GreengrassGroupVersion-'))
+
+        names, before = stacks_of_groups(1)
+        self.assertEqual(names, ['fleet'])
+        names, after = stacks_of_groups(3)
+        self.assertEqual(names, ['fleet', 'fleet-01', 'fleet-02'])
+        stayed = [group_id for group_id in before if after[group_id] == 'fleet']
+        self.assertGreater(len(stayed), len(before) / 5)
+
+    def test_parameters_do_not_count_against_the_limit(self):
+        groups = STACK_RESOURCE_LIMIT // 5
+        GreengrassCoreGroupDefinitions(core.App(), 'full', deployment_parameter_sets(groups))
+        with self.assertRaises(ValueError):
+            GreengrassCoreGroupDefinitions(core.App(), 'over', deployment_parameter_sets(groups + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
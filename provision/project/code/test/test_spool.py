@@ -0,0 +1,200 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lambda'))
+from spool import DiskSpool, StoreAndForward
+
+
+def records(spool, max_records=1000):
+    return [record for _, record in spool.read_batch(max_records)]
+
+
+class Upstream:
+    # Records the sends, failing while down and for the poisoned records
+    def __init__(self, down=False, poisoned=()):
+        self.down = down
+        self.poisoned = poisoned
+        self.sent = []
+
+    def __call__(self, record):
+        if self.down or record['n'] in self.poisoned:
+            raise Exception('Simulated failure')
+        self.sent.append(record['n'])
+
+
+class TestDiskSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith('.seg'))
+
+    def test_rotates_segments_in_order(self):
+        spool = DiskSpool(self.path, segment_bytes=8)
+        for n in range(5):
+            spool.append({'n': n})
+        self.assertEqual(len(self.segments()), 5)
+        self.assertEqual(records(spool), [{'n': n} for n in range(5)])
+        spool.close()
+
+    def test_evicts_oldest_segments_above_max_bytes(self):
+        spool = DiskSpool(self.path, max_bytes=16, segment_bytes=8)
+        for n in range(5):
+            spool.append({'n': n})
+        self.assertEqual(records(spool), [{'n': 3}, {'n': 4}])
+        self.assertEqual(len(self.segments()), 2)
+        self.assertGreater(spool.evicted, 0)
+        spool.close()
+
+    def test_commit_deletes_drained_segments(self):
+        spool = DiskSpool(self.path, segment_bytes=8)
+        for n in range(3):
+            spool.append({'n': n})
+        batch = spool.read_batch(2)
+        spool.commit(batch[-1][0])
+        self.assertEqual(len(self.segments()), 1)
+        self.assertEqual(records(spool), [{'n': 2}])
+        spool.close()
+
+    def test_restart_resumes_at_the_cursor(self):
+        spool = DiskSpool(self.path)
+        for n in range(4):
+            spool.append({'n': n})
+        spool.commit(spool.read_batch(2)[-1][0])
+        spool.close()
+
+        spool = DiskSpool(self.path)
+        self.assertEqual(records(spool), [{'n': 2}, {'n': 3}])
+        spool.append({'n': 4})
+        self.assertEqual(records(spool), [{'n': 2}, {'n': 3}, {'n': 4}])
+        spool.close()
+
+    def test_torn_last_line_is_skipped(self):
+        with open(os.path.join(self.path, '{:010d}.seg'.format(0)), 'wb') as f:
+            f.write(b'{"n":0}\n{"n":1')
+        spool = DiskSpool(self.path)
+        spool.append({'n': 2})
+        self.assertEqual(records(spool), [{'n': 0}, None, {'n': 2}])
+        spool.commit(spool.read_batch(3)[-1][0])
+        self.assertTrue(spool.empty())
+        spool.close()
+
+    def test_dead_letter_is_outside_the_segments(self):
+        spool = DiskSpool(self.path)
+        spool.dead_letter({'n': 0})
+        self.assertTrue(spool.empty())
+        with open(os.path.join(self.path, 'dead-letter')) as f:
+            self.assertEqual(json.loads(f.readline()), {'n': 0})
+        spool.close()
+
+
+class TestStoreAndForward(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = DiskSpool(self.directory.name)
+
+    def tearDown(self):
+        self.spool.close()
+        self.directory.cleanup()
+
+    def test_sends_directly_while_healthy(self):
+        upstream = Upstream()
+        forward = StoreAndForward(upstream, self.spool)
+        forward.write({'n': 0})
+        self.assertEqual(upstream.sent, [0])
+        self.assertEqual(forward.spooled, 0)
+
+    def test_replays_in_order_after_a_failure(self):
+        upstream = Upstream(down=True)
+        forward = StoreAndForward(upstream, self.spool, batch=2)
+        for n in range(5):
+            forward.write({'n': n})
+        self.assertTrue(forward.spooling)
+        forward.drain()
+        self.assertEqual(upstream.sent, [])
+
+        upstream.down = False
+        forward.write({'n': 5})
+        forward.drain()
+        self.assertEqual(upstream.sent, list(range(6)))
+        self.assertFalse(forward.spooling)
+        forward.write({'n': 6})
+        self.assertEqual(upstream.sent, list(range(7)))
+
+    def test_spooled_records_are_replayed_after_restart(self):
+        forward = StoreAndForward(Upstream(down=True), self.spool)
+        forward.write({'n': 0})
+        forward.write({'n': 1})
+        self.spool.close()
+
+        upstream = Upstream()
+        self.spool = DiskSpool(self.directory.name)
+        forward = StoreAndForward(upstream, self.spool)
+        self.assertTrue(forward.spooling)
+        forward.drain()
+        self.assertEqual(upstream.sent, [0, 1])
+
+    def test_record_is_dead_lettered_after_max_attempts(self):
+        upstream = Upstream(down=True)
+        forward = StoreAndForward(upstream, self.spool, max_attempts=3)
+        for n in range(3):
+            forward.write({'n': n})
+        upstream.down = False
+        upstream.poisoned = (0,)
+        forward.drain()
+        forward.drain()
+        self.assertEqual(upstream.sent, [])
+        forward.drain()
+        self.assertEqual(upstream.sent, [1, 2])
+        self.assertEqual(forward.dead_lettered, 1)
+        self.assertFalse(forward.spooling)
+
+    def test_outage_dead_letters_nothing(self):
+        upstream = Upstream(down=True)
+        forward = StoreAndForward(upstream, self.spool, max_attempts=3)
+        for n in range(5):
+            forward.write({'n': n})
+        for _ in range(300):
+            forward.drain()
+        upstream.down = False
+        forward.drain()
+        self.assertEqual(upstream.sent, list(range(5)))
+        self.assertEqual(forward.dead_lettered, 0)
+
+    def test_last_failing_record_waits_for_a_probe(self):
+        upstream = Upstream(poisoned=(1,))
+        forward = StoreAndForward(upstream, self.spool, max_attempts=2)
+        forward.write({'n': 0})
+        forward.write({'n': 1})
+        for _ in range(3):
+            forward.drain()
+        self.assertEqual(forward.dead_lettered, 0)
+        forward.write({'n': 2})
+        forward.drain()
+        self.assertEqual(upstream.sent, [0, 2])
+        self.assertEqual(forward.dead_lettered, 1)
+
+    def test_zero_max_attempts_retries_forever(self):
+        upstream = Upstream(poisoned=(0,))
+        forward = StoreAndForward(upstream, self.spool, max_attempts=0)
+        forward.write({'n': 0})
+        for _ in range(5):
+            forward.drain()
+        self.assertEqual(forward.dead_lettered, 0)
+        self.assertTrue(forward.spooling)
+
+
+if __name__ == '__main__':
+    unittest.main()
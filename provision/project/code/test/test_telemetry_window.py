@@ -0,0 +1,78 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lambda'))
+from telemetry_window import WindowAggregator, percentile, summarize
+
+
+class TestPercentile(unittest.TestCase):
+
+    def test_single_sample(self):
+        for p in (0, 50, 100):
+            self.assertEqual(percentile([7], p), 7)
+
+    def test_edges_are_min_and_max(self):
+        ordered = [1, 2, 3, 4]
+        self.assertEqual(percentile(ordered, 0), 1)
+        self.assertEqual(percentile(ordered, 100), 4)
+
+    def test_interpolates_between_ranks(self):
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2.5)
+        self.assertAlmostEqual(percentile([0, 10], 90), 9)
+
+    def test_summarize(self):
+        summary = summarize([3, 1, 2], (50,))
+        self.assertEqual(summary, {'count': 3, 'min': 1, 'max': 3, 'mean': 2, 'p50': 2})
+
+
+class TestWindowAggregator(unittest.TestCase):
+
+    def test_only_numeric_fields_are_kept(self):
+        aggregator = WindowAggregator(window=10)
+        aggregator.add('device', {'temperature': 20, 'ok': True, 'unit': 'C'}, now=0)
+        summaries = dict(aggregator.summaries(now=1))
+        self.assertEqual(list(summaries['device']['fields']), ['temperature'])
+
+    def test_samples_leave_the_window(self):
+        aggregator = WindowAggregator(window=10)
+        aggregator.add('device', {'temperature': 20}, now=0)
+        aggregator.add('device', {'temperature': 30}, now=5)
+        summaries = dict(aggregator.summaries(now=9))
+        self.assertEqual(summaries['device']['fields']['temperature']['count'], 2)
+
+        summaries = dict(aggregator.summaries(now=12))
+        self.assertEqual(summaries['device']['fields']['temperature']['count'], 1)
+        self.assertEqual(summaries['device']['fields']['temperature']['min'], 30)
+
+        # Devices without samples in the window are forgotten
+        self.assertEqual(list(aggregator.summaries(now=20)), [])
+        self.assertEqual(aggregator.fields, {})
+
+    def test_samples_past_max_samples_are_dropped(self):
+        aggregator = WindowAggregator(window=60, max_samples=3)
+        for n in range(5):
+            aggregator.add('device', {'temperature': n}, now=n)
+        summary = dict(aggregator.summaries(now=5))['device']['fields']['temperature']
+        self.assertEqual((summary['count'], summary['min'], summary['dropped']), (3, 2, 2))
+        # The count is per summary
+        aggregator.add('device', {'temperature': 5}, now=5)
+        summary = dict(aggregator.summaries(now=6))['device']['fields']['temperature']
+        self.assertEqual((summary['count'], summary['dropped']), (3, 1))
+        summary = dict(aggregator.summaries(now=7))['device']['fields']['temperature']
+        self.assertEqual(summary['dropped'], 0)
+
+    def test_samples_out_of_the_window_are_not_dropped(self):
+        aggregator = WindowAggregator(window=2, max_samples=2)
+        aggregator.add('device', {'temperature': 0}, now=0)
+        aggregator.add('device', {'temperature': 1}, now=1)
+        aggregator.add('device', {'temperature': 10}, now=10)
+        summary = dict(aggregator.summaries(now=10))['device']['fields']['temperature']
+        self.assertEqual((summary['count'], summary['dropped']), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
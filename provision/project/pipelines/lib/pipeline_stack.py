@@ -2,11 +2,15 @@
 ## SPDX-License-Identifier: MIT-0
 
 from aws_cdk import (core, aws_codebuild as codebuild,
+                     aws_cloudwatch as cloudwatch,
                      aws_codecommit as codecommit,
                      aws_codepipeline as codepipeline,
                      aws_codepipeline_actions as codepipeline_actions,
+                     aws_events as events,
+                     aws_events_targets as events_targets,
                      aws_iam as iam,
                      aws_s3 as s3,
+                     aws_sqs as sqs,
                      aws_ssm as ssm,
                      aws_lambda as awslambda)
 
@@ -44,7 +48,20 @@ class PipelineStack(core.Stack):
             parameter_name="/iot-gg-cicd-workshop/s3/prod_deploy_param_bucket", 
             string_value=prod_deploy_param_bucket.bucket_name,
         )
-        
+
+        # Greengrass deployment status changes are queued for the deploy
+        # step so it does not have to poll every group
+        deployment_event_queue = sqs.Queue(self, "DeploymentEventQueue",
+            retention_period=core.Duration.hours(1),
+        )
+        events.Rule(self, "DeploymentStatusChangeRule",
+            event_pattern=events.EventPattern(
+                source=["aws.greengrass"],
+                detail_type=["Greengrass Deployment Status Change"],
+            ),
+            targets=[events_targets.SqsQueue(deployment_event_queue)],
+        )
+
         cdk_build = codebuild.PipelineProject(
             self,
             "Build",
@@ -70,7 +87,10 @@ class PipelineStack(core.Stack):
             project_name="iot-gg-cicd-workshop-deploy-canary",
             build_spec=codebuild.BuildSpec.from_source_filename("deployspec.yml"),
             environment_variables={
-                "AWS_DEFAULT_REGION": codebuild.BuildEnvironmentVariable(value=kwargs['env'].region)
+                "AWS_DEFAULT_REGION": codebuild.BuildEnvironmentVariable(value=kwargs['env'].region),
+                "DEPLOY_EVENT_QUEUE_URL": codebuild.BuildEnvironmentVariable(value=deployment_event_queue.queue_url),
+                "DEPLOY_CHECKPOINT_BUCKET": codebuild.BuildEnvironmentVariable(value=prod_deploy_param_bucket.bucket_name),
+                "DISCOVERY_CACHE_BUCKET": codebuild.BuildEnvironmentVariable(value=prod_deploy_param_bucket.bucket_name),
             })
 
         add_policies(
@@ -133,14 +153,19 @@ class PipelineStack(core.Stack):
                                 build=dict(
                                     commands=[
                                         "ls -la",
-                                        "make deploy-greengrass-prod",
+                                        "make deploy-greengrass-prod CDK_DEFAULT_REGION=$AWS_DEFAULT_REGION",
                                     ])),
                                 artifacts={
                                 "base-directory": ".",
                                 "files": [
                                     "**/*"]},
                                 environment=dict(buildImage=
-                                codebuild.LinuxBuildImage.STANDARD_2_0))))
+                                codebuild.LinuxBuildImage.STANDARD_2_0))),
+            environment_variables={
+                "DEPLOY_EVENT_QUEUE_URL": codebuild.BuildEnvironmentVariable(value=deployment_event_queue.queue_url),
+                "DEPLOY_CHECKPOINT_BUCKET": codebuild.BuildEnvironmentVariable(value=prod_deploy_param_bucket.bucket_name),
+                "DISCOVERY_CACHE_BUCKET": codebuild.BuildEnvironmentVariable(value=prod_deploy_param_bucket.bucket_name),
+            })
 
         add_policies(
             cdk_deploy_prod, 
@@ -175,5 +200,12 @@ class PipelineStack(core.Stack):
         prod_source_bucket.grant_read_write(cdk_deploy_canary.role)
         prod_source_bucket.grant_read(cdk_deploy_prod.role)
         prod_deploy_param_bucket.grant_read_write(cdk_deploy_canary.role)
+        prod_deploy_param_bucket.grant_read_write(cdk_deploy_prod.role, "checkpoints/*")
+        prod_deploy_param_bucket.grant_read_write(cdk_deploy_prod.role, "discovery-cache/*")
+        deployment_event_queue.grant_consume_messages(cdk_deploy_canary.role)
+        deployment_event_queue.grant_consume_messages(cdk_deploy_prod.role)
+        # Deployment timings, with DEPLOY_METRICS_CLOUDWATCH=true
+        cloudwatch.Metric.grant_put_metric_data(cdk_deploy_canary.role)
+        cloudwatch.Metric.grant_put_metric_data(cdk_deploy_prod.role)
         
 